@@ -5,3 +5,4 @@ __version__ = '0.0.1'
 
 from functions import *
 from rgb import RGB
+from colormap import Colormap
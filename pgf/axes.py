@@ -1,6 +1,8 @@
-from utils import indent, escape
+from utils import indent, escape, render_to, IndentedWriter
+from StringIO import StringIO
 from figure import Figure
 from numpy import min, max, inf, isreal
+from colormap import Colormap
 
 class Axes(object):
 	"""
@@ -129,7 +131,7 @@ class Axes(object):
 	@type interval: boolean
 	@ivar interval: if enabled, neighboring values determine bar widths
 
-	@type colormap: string/None
+	@type colormap: string/Colormap/None
 	@ivar colormap: colormap used by some plots, e.g. 'hot', 'cool', 'bluered'
 
 	@type colorbar: bool/None
@@ -326,6 +328,19 @@ class Axes(object):
 		@return: LaTeX code for this axis
 		"""
 
+		stream = StringIO()
+		self.render_to(stream)
+		return stream.getvalue()
+
+
+	def render_to(self, stream):
+		"""
+		Writes the LaTeX code for this axis to a file or other stream.
+
+		@type  stream: file
+		@param stream: a file-like object
+		"""
+
 		options = [
 			'scale only axis',
 			'width={0}cm'.format(self.width),
@@ -493,7 +508,8 @@ class Axes(object):
 		# box plots
 		from boxplot import BoxPlot
 
-		boxplots = [child for child in self.children if isinstance(child, BoxPlot)]
+		boxplots = [child for child in self.children
+			if isinstance(child, BoxPlot) and not child.prepared]
 
 		if boxplots:
 			limits = [plot.limits() for plot in boxplots]
@@ -511,7 +527,9 @@ class Axes(object):
 				options.append('ymax={0}'.format(ymax))
 
 		# colors and line styles
-		if self.colormap:
+		if isinstance(self.colormap, Colormap):
+			options.append(self.colormap.render())
+		elif self.colormap:
 			options.append('colormap/{0}'.format(self.colormap))
 		if self.cycle_list:
 			options.append(self.cycle_list.render())
@@ -532,11 +550,12 @@ class Axes(object):
 		tex = '% ' + self.comment + '\n' if self.comment else ''
 		tex += '\\begin{{{0}}}[\n'.format(self.axes_type)
 		tex += indent(',\n'.join(options)) + ']\n'
+		stream.write(tex)
+
 		for child in self.children:
-			tex += indent(child.render())
-		tex += '\\end{{{0}}}\n'.format(self.axes_type)
+			render_to(child, IndentedWriter(stream))
 
-		return tex
+		stream.write('\\end{{{0}}}\n'.format(self.axes_type))
 
 
 	def limits(self):
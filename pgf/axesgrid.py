@@ -1,6 +1,7 @@
 from axes import Axes
 from figure import Figure
 from numpy import max, sum, cumsum, asarray
+from StringIO import StringIO
 
 class AxesGrid(object):
 	"""
@@ -83,18 +84,29 @@ class AxesGrid(object):
 
 
 	def render(self):
+		stream = StringIO()
+		self.render_to(stream)
+		return stream.getvalue()
+
+
+	def render_to(self, stream):
+		self.arrange()
+
+		for i, j in self.keys():
+			# render axis
+			self[i, j].render_to(stream)
+
+
+	def arrange(self):
+		"""
+		Positions axes according to their place in the grid.
+		"""
+
 		# compute axis positions
 		x_pos, y_pos = [0.], [0.]
 		x_pos.extend(cumsum(asarray(self.widths()) + self.spacing))
 		y_pos.extend(cumsum(asarray(self.heights()) + self.spacing))
 
-		tex = ''
-
 		for i, j in self.keys():
 			# position axis
 			self[i, j].at = [x_pos[j], y_pos[i]]
-			
-			# render axis
-			tex += self[i, j].render()
-
-		return tex
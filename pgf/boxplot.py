@@ -1,12 +1,49 @@
 from axes import Axes
 from plot import Plot
-from numpy import asarray, arange, shape, percentile, min, max, logical_or, any
-from numpy import where
+from numpy import asarray, arange, shape, percentile, min, max, logical_or, nonzero
+from numpy import repeat, concatenate, searchsorted
+from numpy.ma import masked_array
+from utils import format_coordinates, format_table
+from settings import Settings
+from os import path
+from hashlib import sha1
 
 class BoxPlot(object):
+	"""
+	Renders box plots from samples or from precomputed statistics.
+
+	@type summary: ndarray/None
+	@ivar summary: lower whisker, lower quartile, median, upper quartile and upper whisker of each box
+
+	@type prepared: bool
+	@ivar prepared: if true, boxes are drawn by pgfplots' statistics library instead of TikZ
+	"""
+
+	_counter = 0
+
 	def __init__(self, *args, **kwargs):
+		# precomputed statistics
+		self.summary = kwargs.get('summary', None)
+
+		if self.summary is not None:
+			self.summary = asarray(self.summary, dtype=float).reshape(-1, 5)
+			self.yvalues = None
+
+			if len(args) < 1:
+				self.xvalues = arange(1, len(self.summary) + 1)
+			else:
+				self.xvalues = asarray(args[0]).flatten()
+
+			# outliers of each box
+			outliers = [asarray(y).ravel() for y in kwargs.get('outliers', [[]] * len(self.summary))]
+
+			self._outlier_values = [
+				concatenate([[]] + [repeat(x, len(y)) for x, y in zip(self.xvalues, outliers)]),
+				concatenate([[]] + outliers),
+				repeat(arange(len(outliers)), [len(y) for y in outliers])]
+
 		# data points
-		if len(args) < 1:
+		elif len(args) < 1:
 			self.xvalues = asarray([])
 			self.yvalues = asarray([])
 		elif len(args) < 2:
@@ -16,8 +53,14 @@ class BoxPlot(object):
 			self.xvalues = asarray(args[0]).flatten()
 			self.yvalues = asarray(args[1]).reshape(shape(args[1])[0], -1)
 
+		# statistics computed from data points, see _statistics()
+		self._cache = None
+
 		self.box_width = kwargs.get('box_width', 0.5);
 
+		# let pgfplots draw each box as a single plot
+		self.prepared = kwargs.get('prepared', False)
+
 		# custom plot options
 		self.pgf_options = kwargs.get('pgf_options', [])
 
@@ -25,10 +68,23 @@ class BoxPlot(object):
 		if not isinstance(self.pgf_options, list):
 			raise TypeError('pgf_options should be a list.')
 
+		# store outliers inside or outside of the LaTeX file
+		self.data_mode = kwargs.get('data_mode', None)
+
+		if self.data_mode not in [None, 'inline', 'table']:
+			raise ValueError('Unknown data mode \'{0}\'.'.format(self.data_mode))
+
+		if self.prepared:
+			# outliers of prepared boxes are always stored in the LaTeX file
+			self.data_mode = 'inline'
+
 		# add plot to axes
 		self.axes = kwargs.get('axes', Axes.gca())
 		self.axes.children.append(self)
 
+		self.idx = BoxPlot._counter
+		BoxPlot._counter += 1
+
 
 	def render(self):
 		"""
@@ -41,48 +97,174 @@ class BoxPlot(object):
 		options = []
 		marker_options = []
 
-		tex = ''
+		table = (self.data_mode or self.axes.figure.data_mode) == 'table'
 
-		for k in range(len(self.xvalues)):
-			qu1 = percentile(self.yvalues[:, k], 25)
-			med = percentile(self.yvalues[:, k], 50)
-			qu2 = percentile(self.yvalues[:, k], 75)
-			iqr = qu2 - qu1
+		lower, qu1, med, qu2, upper = self._statistics()
+		outliers = self._outliers()
 
-			outlier = logical_or(
-				self.yvalues[:, k] > qu2 + 1.5 * iqr,
-				self.yvalues[:, k] < qu1 - 1.5 * iqr)
+		# outliers of k-th box are found between offsets[k] and offsets[k + 1]
+		offsets = searchsorted(outliers[2], arange(len(self.xvalues) + 1))
+
+		if self.prepared:
+			return self._render_prepared(outliers, offsets)
 
+		tex = []
+
+		for k in range(len(self.xvalues)):
 			# median
-			tex += '\\draw[red] (axis cs:{0},{1}) -- (axis cs:{2},{3});\n'.format(
-				self.xvalues[k] - self.box_width / 2., med,
-				self.xvalues[k] + self.box_width / 2., med)
+			tex.append('\\draw[red] (axis cs:{0},{1}) -- (axis cs:{2},{3});\n'.format(
+				self.xvalues[k] - self.box_width / 2., med[k],
+				self.xvalues[k] + self.box_width / 2., med[k]))
 
 			# box
-			tex += '\\draw[blue] (axis cs:{0},{1}) rectangle (axis cs:{2},{3});\n'.format(
-				self.xvalues[k] - self.box_width / 2., qu1,
-				self.xvalues[k] + self.box_width / 2., qu2)
+			tex.append('\\draw[blue] (axis cs:{0},{1}) rectangle (axis cs:{2},{3});\n'.format(
+				self.xvalues[k] - self.box_width / 2., qu1[k],
+				self.xvalues[k] + self.box_width / 2., qu2[k]))
 
 			# whiskers
-			tex += '\\draw[|-, densely dashed] (axis cs:{0},{1}) -- (axis cs:{2},{3});\n'.format(
-				self.xvalues[k], min(self.yvalues[-outlier, k]),
-				self.xvalues[k], qu1)
-			tex += '\\draw[-|, densely dashed] (axis cs:{0},{1}) -- (axis cs:{2},{3});\n'.format(
-				self.xvalues[k], qu2,
-				self.xvalues[k], max(self.yvalues[-outlier, k]))
+			tex.append('\\draw[|-, densely dashed] (axis cs:{0},{1}) -- (axis cs:{2},{3});\n'.format(
+				self.xvalues[k], lower[k],
+				self.xvalues[k], qu1[k]))
+			tex.append('\\draw[-|, densely dashed] (axis cs:{0},{1}) -- (axis cs:{2},{3});\n'.format(
+				self.xvalues[k], qu2[k],
+				self.xvalues[k], upper[k]))
+
+			if offsets[k + 1] > offsets[k] and not table:
+				tex.append('\\addplot[red, mark=+, only marks] coordinates {\n')
+				tex.append(format_coordinates([
+					outliers[0][offsets[k]:offsets[k + 1]],
+					outliers[1][offsets[k]:offsets[k + 1]]]))
+				tex.append('};\n')
+
+		if table and len(outliers[0]):
+			# outliers of all boxes are stored in one data file
+			tex.append('\\addplot[red, mark=+, only marks] table[x index=0, y index=1, header=false] {{{0}}};\n'.format(
+				path.join(Settings.data_folder, self.filename())))
+
+		return ''.join(tex)
+
+
+	def _render_prepared(self, outliers, offsets):
+		"""
+		Produces one plot per box using pgfplots' C{boxplot prepared}, so that
+		pgfplots also takes care of the axis limits. Outliers are always stored
+		inside the LaTeX file.
+		"""
+
+		lower, qu1, med, qu2, upper = self._statistics()
+
+		options = [
+			'blue',
+			'mark=+',
+			'mark options={red}',
+			'boxplot/every median/.style={red}',
+			'boxplot/every whisker/.style={densely dashed}']
+		options.extend(self.pgf_options)
+		options = ', '.join(options)
+
+		tex = []
+
+		for k in range(len(self.xvalues)):
+			tex.append('\\addplot[{0}, boxplot prepared={{'.format(options))
+			tex.append('draw position={0}, box extend={1}, '.format(self.xvalues[k], self.box_width))
+			tex.append('lower whisker={0}, lower quartile={1}, median={2}, '.format(lower[k], qu1[k], med[k]))
+			tex.append('upper quartile={0}, upper whisker={1}}}] coordinates {{'.format(qu2[k], upper[k]))
 
-			if any(outlier):
-				tex += '\\addplot[red, mark=+, only marks] coordinates {\n'
-				for i in where(outlier)[0]:
-					tex += '\t({0}, {1})\n'.format(self.xvalues[k], self.yvalues[i, k])
-				tex += '};\n'
+			if offsets[k + 1] > offsets[k]:
+				tex.append('\n')
+				tex.append(format_coordinates([
+					repeat(0, offsets[k + 1] - offsets[k]),
+					outliers[1][offsets[k]:offsets[k + 1]]]))
 
-		return tex
+			tex.append('};\n')
+
+		return ''.join(tex)
+
+
+	def _statistics(self):
+		"""
+		Computes quartiles and whiskers of all boxes at once. Whiskers extend to
+		the most extreme data points within 1.5 interquartile ranges of the box.
+		Results are kept until the data points are replaced.
+
+		@rtype: list
+		@return: lower whiskers, lower quartiles, medians, upper quartiles and upper whiskers
+		"""
+
+		if self.summary is not None:
+			return list(self.summary.T)
+
+		# data may have been replaced or changed in place
+		digest = sha1()
+		for values in [self.xvalues, self.yvalues]:
+			values = asarray(values)
+			digest.update(str((values.dtype, values.shape)))
+			digest.update(values.tobytes())
+		digest = digest.digest()
+
+		if not len(self.xvalues):
+			self._cache = (digest, [asarray([])] * 5, [asarray([])] * 3)
+
+		if self._cache is None or self._cache[0] != digest:
+			qu1, med, qu2 = percentile(self.yvalues, [25, 50, 75], axis=0)
+			iqr = qu2 - qu1
+
+			outlier = logical_or(
+				self.yvalues > qu2 + 1.5 * iqr,
+				self.yvalues < qu1 - 1.5 * iqr)
+
+			lower = masked_array(self.yvalues, outlier).min(axis=0).data
+			upper = masked_array(self.yvalues, outlier).max(axis=0).data
+
+			# coordinates of outliers, sorted by box
+			k, i = nonzero(outlier.T)
+
+			self._cache = (digest,
+				[lower, qu1, med, qu2, upper],
+				[self.xvalues[k], self.yvalues[i, k], k])
+
+		return self._cache[1]
+
+
+	def _outliers(self):
+		"""
+		Returns x- and y-coordinates of outliers of all boxes and the index of
+		the box each outlier belongs to.
+		"""
+
+		if self.summary is not None:
+			return self._outlier_values
+
+		self._statistics()
+
+		return self._cache[2]
+
+
+	def filename(self):
+		return \
+			str(self.axes.figure._session) + '_box_' + \
+			str(self.idx) + '.dat'
+
+
+	def save(self, filepath=''):
+		"""
+		Writes outliers into a whitespace-separated data file.
+
+		@type  filepath: string
+		@param filepath: directory in which the data file is stored
+		"""
+
+		with open(path.join(filepath, self.filename()), 'w') as handle:
+			xvalues, yvalues, _ = self._outliers()
+			handle.write(format_table([asarray(xvalues, dtype=float), yvalues]))
 
 
 	def limits(self):
+		lower, _, _, _, upper = self._statistics()
+		outliers = self._outliers()[1]
+
 		return [
 			min(self.xvalues) - self.box_width,
 			max(self.xvalues) + self.box_width,
-			min(self.yvalues) - self.box_width,
-			max(self.yvalues) + self.box_width]
+			min(concatenate([lower, outliers])) - self.box_width,
+			max(concatenate([upper, outliers])) + self.box_width]
@@ -0,0 +1,142 @@
+from os import path, makedirs, listdir, remove, rename, link, utime, stat, getpid
+from shutil import copyfile
+from contextlib import contextmanager
+from threading import current_thread
+from fcntl import flock, LOCK_SH, LOCK_EX, LOCK_UN
+
+class Cache(object):
+	"""
+	Stores compiled PDF files under a key, usually a hash of everything which
+	went into compiling them. The cache is shared between processes and the
+	least recently used files are removed once the cache grows too large.
+
+	@type directory: string
+	@ivar directory: where cached files are stored
+
+	@type size: integer
+	@ivar size: maximum size of the cache in bytes
+	"""
+
+	def __init__(self, directory, size):
+		self.directory = directory
+		self.size = size
+
+		if not path.exists(self.directory):
+			try:
+				# only accessible by the user
+				makedirs(self.directory, 0700)
+			except OSError:
+				# directory was created by another process
+				if not path.isdir(self.directory):
+					raise
+
+
+	def get(self, key, filename):
+		"""
+		Retrieves a file from the cache.
+
+		@type  key: string
+		@param key: identifies the cached file
+
+		@type  filename: string
+		@param filename: where the cached file will be made available
+
+		@rtype: boolean
+		@return: true if the key was found in the cache
+		"""
+
+		cached = self._filename(key)
+
+		with self._lock(LOCK_SH):
+			if not path.exists(cached):
+				return False
+
+			_link(cached, filename)
+
+			# mark file as recently used
+			utime(cached, None)
+
+		return True
+
+
+	def put(self, key, filename):
+		"""
+		Copies a file into the cache and removes least recently used files if
+		the cache becomes too large.
+
+		@type  key: string
+		@param key: identifies the cached file
+
+		@type  filename: string
+		@param filename: file to be cached
+		"""
+
+		cached = self._filename(key)
+		tmp_file = '{0}.{1}.{2}.tmp'.format(cached, getpid(), current_thread().ident)
+
+		# copy first so that other processes never see incomplete files
+		copyfile(filename, tmp_file)
+
+		with self._lock(LOCK_EX):
+			try:
+				rename(tmp_file, cached)
+			except OSError:
+				# the same file may just have been cached by another process
+				if path.exists(tmp_file):
+					remove(tmp_file)
+				if not path.exists(cached):
+					raise
+			self._evict()
+
+
+	def _evict(self):
+		"""
+		Removes least recently used files until the cache is small enough.
+		"""
+
+		files = []
+		for f in listdir(self.directory):
+			if f.endswith('.pdf'):
+				f = path.join(self.directory, f)
+				files.append((stat(f).st_mtime, stat(f).st_size, f))
+
+		total = sum(size for _, size, _ in files)
+
+		for _, size, f in sorted(files):
+			if total <= self.size:
+				break
+			remove(f)
+			total -= size
+
+
+	def _filename(self, key):
+		return path.join(self.directory, key + '.pdf')
+
+
+	@contextmanager
+	def _lock(self, operation):
+		"""
+		Synchronizes access to the cache among processes.
+		"""
+
+		with open(path.join(self.directory, 'lock'), 'a') as handle:
+			flock(handle, operation)
+			try:
+				yield
+			finally:
+				flock(handle, LOCK_UN)
+
+
+
+def _link(source, target):
+	"""
+	Makes a file available under another name, avoiding a copy if possible.
+	"""
+
+	if path.exists(target):
+		remove(target)
+
+	try:
+		link(source, target)
+	except OSError:
+		copyfile(source, target)
@@ -1,55 +1,50 @@
-from numpy import asarray
+from numpy import asarray, arange, minimum, around, linspace
 
 class Colormap(object):
 	"""
-	Represents a color map. Each color map is basically a list of 256 RGB values.
+	Represents a color map. Each color map is basically a table of RGB values,
+	stored as an array of type uint8 with one row per color.
+
+	@type colors: ndarray
+	@ivar colors: RGB values
 	"""
 
-	def __init__(self, colors, interp='linear'):
+	def __init__(self, colors, interp='linear', size=256):
 		"""
-		Computes color map. If less than 256 RGB values are given, interpolates
-		linearly between the colors.
+		Computes color map. If less than C{size} RGB values are given,
+		interpolates between the colors.
 
-		@type  colors: list
+		@type  colors: array_like
 		@param colors: a list of tuples or lists encoding RGB colors
 
 		@type  interp: string
 		@param interp: interpolation ('linear' or 'nearest')
+
+		@type  size: integer
+		@param size: number of colors, e.g. 4096 to display 16-bit data
 		"""
 
-		if len(colors) < 256:
-			self.colors = []
+		if len(colors) < size:
+			colors = asarray(colors, dtype=float)
+
+			# position of each color in list of given colors
+			j = (len(colors) - 1.) / (size - 1.) * arange(size)
+			k = minimum(asarray(j, dtype=int), len(colors) - 1)
+			w = j - k
+
+			# index of following color
+			l = minimum(k + 1, len(colors) - 1)
 
 			if interp == 'nearest':
-				for i in range(256):
-					j = (len(colors) - 1.) / 255. * i
-					k = int(j)
-					w = j - k
-
-					if k < len(colors) - 1:
-						if w > 0.5:
-							self.colors.append(colors[k + 1])
-						else:
-							self.colors.append(colors[k])
-					else:
-						self.colors.append(colors[k])
-				
+				self.colors = asarray(colors[k], dtype='uint8')
+				self.colors[w > 0.5] = colors[l[w > 0.5]]
 
 			else:
-				for i in range(256):
-					j = (len(colors) - 1.) / 255. * i
-					k = int(j)
-					w = j - k
-
-					if k < len(colors) - 1:
-						self.colors.append(
-							asarray(colors[k]) * (1. - w) + asarray(colors[k + 1]) * w)
-						self.colors[-1] = asarray(self.colors[-1] + 0.5, 'uint8').tolist()
-					else:
-						self.colors.append(colors[k])
-					
+				self.colors = asarray(
+					colors[k] * (1. - w[:, None]) + colors[l] * w[:, None] + 0.5, dtype='uint8')
+
 		else:
-			self.colors = colors
+			self.colors = asarray(colors, dtype='uint8')
 
 
 
@@ -58,20 +53,48 @@ class Colormap(object):
 
 
 
-colormaps = {
-	'gray': Colormap([
+	def __len__(self):
+		return len(self.colors)
+
+
+
+	def render(self, name='pgf', size=64):
+		"""
+		Produces a pgfplots color map definition approximating this color map,
+		e.g. to show it in a color bar.
+
+		@type  name: string
+		@param name: name under which the color map is defined
+
+		@type  size: integer
+		@param size: maximum number of colors between which pgfplots interpolates
+
+		@rtype: string
+		@return: pgfplots option defining and selecting the color map
+		"""
+
+		indices = asarray(around(linspace(0, len(self) - 1, min(size, len(self)))), dtype=int)
+
+		return 'colormap={{{0}}}{{{1}}}'.format(name, '; '.join(
+			'rgb255({0}cm)=({1},{2},{3})'.format(i, *self.colors[k]) for i, k in enumerate(indices)))
+
+
+
+# colors and interpolation of built-in color maps
+_colors = {
+	'gray': ([
 		[0, 0, 0],
 		[255, 255, 255],
-		]),
-	'jet': Colormap([
+		], 'linear'),
+	'jet': ([
 		[0, 0, 144],
 		[0, 0, 255],
 		[0, 255, 255],
 		[255, 255, 0],
 		[255, 0, 0],
 		[128, 0, 0],
-		]),
-	'hsv': Colormap([
+		], 'linear'),
+	'hsv': ([
 		[255, 0, 0],
 		[255, 255, 0],
 		[0, 255, 0],
@@ -79,28 +102,28 @@ colormaps = {
 		[0, 0, 255],
 		[255, 0, 255],
 		[255, 0, 0],
-		]),
-	'winter': Colormap([
+		], 'linear'),
+	'winter': ([
 		[0, 0, 255],
 		[0, 255, 128],
-		]),
-	'cool': Colormap([
+		], 'linear'),
+	'cool': ([
 		[0, 255, 255],
 		[255, 0, 255],
-		]),
-	'hot': Colormap([
+		], 'linear'),
+	'hot': ([
 		[0, 0, 0],
 		[255, 0, 0],
 		[255, 255, 0],
 		[255, 255, 255],
-		]),
-	'cold': Colormap([
+		], 'linear'),
+	'cold': ([
 		[0, 0, 0],
 		[0, 0, 255],
 		[0, 255, 255],
 		[255, 255, 255],
-		]),
-	'cartoon': Colormap([
+		], 'linear'),
+	'cartoon': ([
 		[255, 255, 255],
 		[0, 0, 255],
 		[0, 42, 255],
@@ -111,7 +134,7 @@ colormaps = {
 		[252, 164, 0],
 		[209, 0, 0],
 		], 'nearest'),
-	'shadows': Colormap([
+	'shadows': ([
 		[255, 255, 255],
 		[223, 223, 223],
 		[191, 191, 191],
@@ -123,3 +146,6 @@ colormaps = {
 		[0, 0, 0],
 		], 'nearest'),
 }
+
+# built-in color maps
+colormaps = dict((name, Colormap(*_colors[name])) for name in _colors)
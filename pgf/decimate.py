@@ -0,0 +1,196 @@
+from numpy import asarray, arange, abs, floor, argmax, lexsort, unique, flatnonzero
+from numpy import concatenate, clip, diff, all, sqrt, zeros
+
+def lttb(xvalues, yvalues, threshold):
+	"""
+	Selects data points using the I{largest triangle three buckets} algorithm.
+	The first and last data points are always kept, the remaining points are
+	split into buckets and the point spanning the largest triangle with its
+	neighbors is picked from each bucket.
+
+	@type  xvalues: array_like
+	@param xvalues: x-coordinates of data points
+
+	@type  yvalues: array_like
+	@param yvalues: y-coordinates of data points
+
+	@type  threshold: integer
+	@param threshold: number of data points to keep
+
+	@rtype: ndarray
+	@return: indices of the selected data points
+	"""
+
+	xvalues = asarray(xvalues, dtype=float)
+	yvalues = asarray(yvalues, dtype=float)
+
+	if threshold >= len(xvalues) or threshold < 3:
+		return arange(len(xvalues))
+
+	# bucket boundaries, excluding first and last data point
+	bounds = asarray(floor(
+		arange(threshold - 1) * (len(xvalues) - 2.) / (threshold - 2.)), dtype=int) + 1
+
+	indices = zeros(threshold, dtype=int)
+	indices[-1] = len(xvalues) - 1
+
+	for i in range(threshold - 2):
+		start, end = bounds[i], bounds[i + 1]
+
+		# average of the next bucket
+		if i < threshold - 3:
+			x = xvalues[end:bounds[i + 2]].mean()
+			y = yvalues[end:bounds[i + 2]].mean()
+		else:
+			x, y = xvalues[-1], yvalues[-1]
+
+		# point selected from previous bucket
+		a = indices[i]
+
+		area = abs(
+			(xvalues[a] - x) * (yvalues[start:end] - yvalues[a]) -
+			(xvalues[a] - xvalues[start:end]) * (y - yvalues[a]))
+
+		indices[i + 1] = start + argmax(area)
+
+	return indices
+
+
+def minmax(xvalues, yvalues, bins, xmin=None, xmax=None):
+	"""
+	Selects the first, last, smallest and largest data point falling into each
+	of a number of equally sized intervals along the x-axis. If each interval
+	corresponds to a pixel column, a line through the remaining points is
+	rendered the same as a line through all data points. Assumes that
+	x-coordinates are sorted.
+
+	@type  xvalues: array_like
+	@param xvalues: x-coordinates of data points
+
+	@type  yvalues: array_like
+	@param yvalues: y-coordinates of data points
+
+	@type  bins: integer
+	@param bins: number of intervals along the x-axis
+
+	@type  xmin: float/None
+	@param xmin: beginning of first interval
+
+	@type  xmax: float/None
+	@param xmax: end of last interval
+
+	@rtype: ndarray
+	@return: indices of the selected data points
+	"""
+
+	xvalues = asarray(xvalues, dtype=float)
+	yvalues = asarray(yvalues, dtype=float)
+
+	if 4 * bins >= len(xvalues):
+		return arange(len(xvalues))
+
+	if xmin is None:
+		xmin = xvalues[0]
+	if xmax is None:
+		xmax = xvalues[-1]
+	if xmax <= xmin:
+		return arange(len(xvalues))
+
+	# assign data points to pixel columns
+	columns = asarray(floor((xvalues - xmin) / (xmax - xmin) * bins), dtype=int)
+	columns = clip(columns, -1, bins)
+
+	# beginning and end of each column
+	first = concatenate([[0], flatnonzero(diff(columns)) + 1])
+	last = concatenate([first[1:] - 1, [len(columns) - 1]])
+
+	# sort by column, then by value
+	order = lexsort((yvalues, columns))
+
+	return unique(concatenate([first, last, order[first], order[last]]))
+
+
+def douglas_peucker(xvalues, yvalues, tolerance):
+	"""
+	Simplifies a line using the Ramer-Douglas-Peucker algorithm. Data points
+	are removed as long as the simplified line stays within the given distance
+	of all data points.
+
+	@type  xvalues: array_like
+	@param xvalues: x-coordinates of data points
+
+	@type  yvalues: array_like
+	@param yvalues: y-coordinates of data points
+
+	@type  tolerance: float
+	@param tolerance: largest allowed distance to the original line
+
+	@rtype: ndarray
+	@return: indices of the selected data points
+	"""
+
+	xvalues = asarray(xvalues, dtype=float)
+	yvalues = asarray(yvalues, dtype=float)
+
+	if len(xvalues) < 3:
+		return arange(len(xvalues))
+
+	keep = zeros(len(xvalues), dtype=bool)
+	keep[0] = keep[-1] = True
+
+	stack = [(0, len(xvalues) - 1)]
+
+	while stack:
+		start, end = stack.pop()
+
+		if end - start < 2:
+			continue
+
+		dx = xvalues[end] - xvalues[start]
+		dy = yvalues[end] - yvalues[start]
+		norm = sqrt(dx * dx + dy * dy)
+
+		# distance of intermediate points to line segment
+		px = xvalues[start + 1:end] - xvalues[start]
+		py = yvalues[start + 1:end] - yvalues[start]
+		if norm > 0.:
+			dist = abs(dx * py - dy * px) / norm
+		else:
+			dist = sqrt(px * px + py * py)
+
+		i = argmax(dist)
+
+		if dist[i] > tolerance:
+			keep[start + 1 + i] = True
+			stack.append((start, start + 1 + i))
+			stack.append((start + 1 + i, end))
+
+	return flatnonzero(keep)
+
+
+def visible(xvalues, xmin=None, xmax=None):
+	"""
+	Returns the range of data points within the given limits, extended by one
+	data point on each side so that lines leaving the axes are kept intact.
+	Assumes that x-coordinates are sorted.
+
+	@rtype: tuple
+	@return: first and last index of visible data points (exclusive)
+	"""
+
+	start, end = 0, len(xvalues)
+
+	if xmin is not None:
+		start = max(0, xvalues.searchsorted(xmin, 'left') - 1)
+	if xmax is not None:
+		end = min(len(xvalues), xvalues.searchsorted(xmax, 'right') + 1)
+
+	return start, end
+
+
+def is_sorted(xvalues):
+	"""
+	Tests whether the x-coordinates are sorted in increasing order.
+	"""
+
+	return len(xvalues) < 2 or all(diff(xvalues) >= 0)
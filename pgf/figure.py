@@ -1,5 +1,14 @@
-from os import path, system, mkdir
-from utils import min_free, indent
+from os import path, system, mkdir, remove, rename
+from hashlib import sha1
+from re import match
+from cache import Cache
+from latexformat import preamble_format
+from latex import latex_command, run_latex
+from shutil import copyfile
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from utils import min_free, render_to, IndentedWriter
+from StringIO import StringIO
 from settings import Settings
 from numpy.random import randint
 
@@ -12,6 +21,12 @@ class Figure(object):
 
 	@type sans_serif: boolean
 	@ivar sans_serif: if true, use Helvetica instead of serif Computer Modern
+
+	@type data_mode: string
+	@ivar data_mode: 'inline' or 'table'; the latter stores plot data in separate files
+
+	@type externalize: boolean
+	@ivar externalize: if true, axes are compiled separately and reused if unchanged
 	"""
 
 	# references to all figures
@@ -23,6 +38,9 @@ class Figure(object):
 	# identifier for above set of figures
 	_session = randint(1E8)
 
+	# threads compiling figures in the background
+	_background = None
+
 	@staticmethod
 	def gcf():
 		"""
@@ -74,6 +92,15 @@ class Figure(object):
 			# whether to use Helvetica or Computer Modern
 			self.sans_serif = kwargs.get('sans_serif', False)
 
+			# whether to store plot data inside or outside of the LaTeX file
+			self.data_mode = kwargs.get('data_mode', Settings.data_mode)
+
+			if self.data_mode not in ['inline', 'table']:
+				raise ValueError('Unknown data mode \'{0}\'.'.format(self.data_mode))
+
+			# whether to compile each axes separately
+			self.externalize = kwargs.get('externalize', Settings.externalize)
+
 			# currently active axes
 			self._ca = None
 
@@ -89,6 +116,23 @@ class Figure(object):
 		@return: LaTeX code for this figure
 		"""
 
+		stream = StringIO()
+		self.render_to(stream)
+		return stream.getvalue()
+
+
+	def render_to(self, stream, panels=None):
+		"""
+		Writes LaTeX code for this figure to a file or other stream. Unlike
+		L{render}, the code is never held in memory as a whole.
+
+		@type  stream: file
+		@param stream: a file-like object
+
+		@type  panels: dict/None
+		@param panels: maps axes to PDF files which are included instead of rendering the axes
+		"""
+
 		# figure width and height
 		width, height = self.width, self.height
 
@@ -105,19 +149,13 @@ class Figure(object):
 			if not height:
 				height = self.margin * 2. + 1.
 
-		preamble = Settings.preamble
+		stream.write(self._preamble())
 
-		if self.sans_serif:
-		   preamble = preamble + \
-			'\\usepackage[T1]{fontenc}\n' + \
-			'\\usepackage{helvet}\n' + \
-			'\\renewcommand{\\familydefault}{\\sfdefault}\n' + \
-			'\\usepackage{sfmath}\n'
+		if Settings.preamble_format:
+			# everything above is loaded from a precompiled format
+			stream.write('%endofdump\n')
 
-		tex = \
-			'\\documentclass{article}\n' + \
-			'\n' + \
-			preamble + \
+		stream.write(
 			'\n' + \
 			'\\usepackage[\n' + \
 			'\tmargin=0cm,\n' + \
@@ -126,22 +164,100 @@ class Figure(object):
 			'\n' + \
 			'\\begin{document}\n' + \
 			'\t\\thispagestyle{empty}\n' + \
-			'\n'
+			'\n')
 		if self.axes:
-			tex += \
+			stream.write(
 				'\t\\begin{figure}\n' + \
 				'\t\t\\centering\n' + \
-				'\t\t\\begin{tikzpicture}\n'
-			for ax in self.axes:
-				tex += indent(ax.render(), 3)
-			tex += \
+				'\t\t\\begin{tikzpicture}\n')
+			if panels is None:
+				for ax in self.axes:
+					render_to(ax, IndentedWriter(stream, 3))
+			else:
+				for ax in self._axes():
+					x, y = ax.at if ax.at is not None else [0., 0.]
+					stream.write(
+						'\t\t\t\\node[anchor=south west, inner sep=0pt] at ({0}cm, {1}cm) '
+						'{{\\includegraphics{{{2}}}}};\n'.format(
+							x - self.margin, y - self.margin, panels[ax]))
+			stream.write(
 				'\t\t\\end{tikzpicture}\n' + \
-				'\t\\end{figure}\n'
+				'\t\\end{figure}\n')
 		else:
-			tex += '\t\\mbox{}\n'
-		tex += '\\end{document}'
+			stream.write('\t\\mbox{}\n')
+		stream.write('\\end{document}')
 
-		return tex
+
+	def _preamble(self, documentclass='\\documentclass{article}'):
+		"""
+		Returns the part of the LaTeX preamble which is independent of the
+		figure's size and content.
+
+		@type  documentclass: string
+		@param documentclass: first line of the LaTeX code
+
+		@rtype: string
+		@return: LaTeX code
+		"""
+
+		preamble = Settings.preamble
+
+		if self.sans_serif:
+		   preamble = preamble + \
+			'\\usepackage[T1]{fontenc}\n' + \
+			'\\usepackage{helvet}\n' + \
+			'\\renewcommand{\\familydefault}{\\sfdefault}\n' + \
+			'\\usepackage{sfmath}\n'
+
+		from boxplot import BoxPlot
+
+		# axes are not arranged, as this would move axes rendered on their own
+		children = [child for ax in self._axes(arrange=False) for child in ax.children]
+
+		if any(isinstance(child, BoxPlot) and child.prepared for child in children):
+			# needed by box plots rendered by pgfplots
+			preamble = preamble + '\\usepgfplotslibrary{statistics}\n'
+
+		return \
+			documentclass + '\n' + \
+			'\n' + \
+			preamble
+
+
+	def _render_axes_to(self, ax, stream):
+		"""
+		Writes a LaTeX document containing only the given axes. The document's
+		size is that of the axes plus the figure's margin, so that the resulting
+		PDF can be positioned precisely in place of the axes.
+
+		@type  ax: L{Axes}
+		@param ax: axes of this figure
+
+		@type  stream: file
+		@param stream: a file-like object
+		"""
+
+		at = ax.at
+		ax.at = [self.margin, self.margin]
+
+		try:
+			stream.write(self._preamble('\\documentclass[border=0pt]{standalone}'))
+
+			if Settings.preamble_format:
+				stream.write('%endofdump\n')
+
+			stream.write(
+				'\n' + \
+				'\\begin{document}\n' + \
+				'\t\\begin{tikzpicture}\n' + \
+				'\t\t\\useasboundingbox (0cm, 0cm) rectangle ({0}cm, {1}cm);\n'.format(
+					ax.width + 2. * self.margin, ax.height + 2. * self.margin))
+			ax.render_to(IndentedWriter(stream, 2))
+			stream.write(
+				'\t\\end{tikzpicture}\n' + \
+				'\\end{document}')
+		finally:
+			ax.at = at
 
 
 	def compile(self):
@@ -152,25 +268,299 @@ class Figure(object):
 		@return: path to PDF file
 		"""
 
-		self.save_images(Settings.tmp_dir)
+		return self._compile(Settings.tmp_dir)
+
+
+	def compile_async(self, callback=None):
+		"""
+		Compiles the figure in a background thread and returns immediately.
+		Writing images and data as well as running LaTeX happen in the
+		background. The number of LaTeX processes running at the same time is
+		limited by C{Settings.compile_processes}.
+
+		B{Example:}
+
+			>>> result = fig.compile_async()
+			>>> pdf_file = result.get()
+
+		@type  callback: function/None
+		@param callback: called with the path to the PDF file once compilation succeeded
+
+		@rtype: AsyncResult
+		@return: use C{get()} to wait for the path to the PDF file
+		"""
+
+		return Figure._executor().apply_async(self.compile, callback=callback)
+
+
+	def save_async(self, filename, format=None, callback=None):
+		"""
+		Saves the figure in a background thread and returns immediately. See
+		L{save} and L{compile_async}.
+
+		@rtype: AsyncResult
+		@return: use C{get()} to wait for the figure to be saved
+		"""
+
+		return Figure._executor().apply_async(self.save, (filename, format), callback=callback)
+
+
+	@staticmethod
+	def _executor():
+		"""
+		Returns the thread pool used by L{compile_async} and L{save_async}.
+		"""
+
+		if Figure._background is None:
+			Figure._background = ThreadPool(Settings.compile_processes or cpu_count())
+		return Figure._background
+
+
+	@staticmethod
+	def compile_all(figures=None, workers=None):
+		"""
+		Compiles multiple figures in parallel. Each figure is compiled in its own
+		directory, so that LaTeX runs do not interfere with each other. Errors
+		are collected instead of interrupting the compilation of other figures.
+		Independent of C{workers}, no more LaTeX processes than allowed by
+		C{Settings.compile_processes} (default: number of CPUs) run at once.
+
+		B{Example:}
+
+			>>> for pdf_file, error in Figure.compile_all(workers=4):
+			...     print pdf_file if error is None else error
+
+		@type  figures: list/None
+		@param figures: figures to compile (default: all figures)
+
+		@type  workers: integer/None
+		@param workers: maximum number of figures compiled at the same time (default: C{Settings.compile_processes})
+
+		@rtype: list
+		@return: a tuple (pdf_file, error) for each figure
+		"""
+
+		if figures is None:
+			figures = [Figure._figures[idx] for idx in sorted(Figure._figures)]
+		if workers is None:
+			workers = Settings.compile_processes or cpu_count()
+
+		def job(fig):
+			directory = path.join(Settings.tmp_dir,
+				'pgf_{0}_{1}'.format(Figure._session, fig._idx))
+
+			try:
+				if not path.exists(directory):
+					mkdir(directory)
+				return fig._compile(directory), None
+			except Exception as error:
+				return None, error
 
-		tex_file = path.join(Settings.tmp_dir, 'pgf_{0}_{1}.tex'.format(Figure._session, self._idx))
-		pdf_file = path.join(Settings.tmp_dir, 'pgf_{0}_{1}.pdf'.format(Figure._session, self._idx))
+		# LaTeX runs in separate processes, threads only wait for them
+		pool = ThreadPool(max(1, min(workers, len(figures))))
 
-		command = Settings.pdf_compile.format('-output-directory {0} {1}')
-		command = command.format(Settings.tmp_dir, tex_file)
+		try:
+			return pool.map(job, figures)
+		finally:
+			pool.close()
+
+
+	def _compile(self, directory):
+		"""
+		Generates LaTeX code and compiles it into a PDF file.
+
+		@type  directory: string
+		@param directory: where LaTeX code, images and the PDF file are stored
+
+		@rtype: string
+		@return: path to PDF file
+		"""
+
+		self.save_images(directory)
+		self.save_data(directory)
+
+		panels = self._externalize(directory) if self.externalize else None
+
+		tex_file = path.join(directory, 'pgf_{0}_{1}.tex'.format(Figure._session, self._idx))
+		pdf_file = path.join(directory, 'pgf_{0}_{1}.pdf'.format(Figure._session, self._idx))
 
 		# write LaTeX file
 		with open(tex_file, 'w') as handle:
-			handle.write(self.render())
+			self.render_to(handle, panels)
+
+		return self._pdflatex(directory, tex_file, pdf_file,
+			self._preamble(), list(self._children()))
+
+
+	def _externalize(self, directory):
+		"""
+		Compiles each axes into a separate PDF file. Files are named after a hash
+		of their content, so that only axes which changed since the last time
+		need to be compiled again.
+
+		@type  directory: string
+		@param directory: where LaTeX code, images and PDF files are stored
+
+		@rtype: dict
+		@return: maps axes to PDF files
+		"""
+
+		panels = {}
+		jobs = {}
+
+		for k, ax in enumerate(self._axes()):
+			tex_file = path.join(directory,
+				'pgf_{0}_{1}_{2}.tex'.format(Figure._session, self._idx, k))
+
+			with open(tex_file, 'w') as handle:
+				self._render_axes_to(ax, handle)
+
+			name = 'pgf_axes_' + self._cache_key(directory, tex_file, ax.children)
+			panels[ax] = name + '.pdf'
+
+			if name in jobs or path.exists(path.join(directory, name + '.pdf')):
+				# axes did not change or are identical to other axes
+				remove(tex_file)
+			else:
+				rename(tex_file, path.join(directory, name + '.tex'))
+				jobs[name] = ax
+
+		def job(args):
+			name, ax = args
+			self._pdflatex(directory,
+				path.join(directory, name + '.tex'),
+				path.join(directory, name + '.pdf'),
+				self._preamble('\\documentclass[border=0pt]{standalone}'),
+				ax.children)
+
+		if jobs:
+			# LaTeX runs in separate processes, threads only wait for them
+			pool = ThreadPool(min(cpu_count(), len(jobs)))
+
+			try:
+				pool.map(job, jobs.items())
+			finally:
+				pool.close()
+
+		return panels
+
+
+	def _pdflatex(self, directory, tex_file, pdf_file, preamble, children):
+		"""
+		Compiles a LaTeX file unless the PDF file can be retrieved from the cache.
+
+		@type  directory: string
+		@param directory: where LaTeX code, images and the PDF file are stored
+
+		@type  preamble: string
+		@param preamble: preamble used by the LaTeX file
+
+		@type  children: list
+		@param children: plots and images referenced by the LaTeX file
+
+		@rtype: string
+		@return: path to PDF file
+		"""
+
+		options = ['-output-directory', directory, tex_file]
+
+		if Settings.preamble_format:
+			# load precompiled preamble
+			fmt_file = preamble_format(preamble)
+			if fmt_file:
+				options = ['-fmt', fmt_file] + options
+
+		command = latex_command(Settings.pdf_compile, options)
+
+		if Settings.cache_dir:
+			# reuse previously compiled PDF
+			cache = Cache(Settings.cache_dir, Settings.cache_size)
+			key = self._cache_key(directory, tex_file, children)
+			if cache.get(key, pdf_file):
+				return pdf_file
+
+		# PDF file might be linked to a cached file
+		if path.exists(pdf_file):
+			remove(pdf_file)
 
 		# compile
-		if system('cd "{0}" && {1}'.format(Settings.tmp_dir, command)):
-			raise RuntimeError('Compiling TeX source file to PDF failed.')
+		try:
+			run_latex(command, directory,
+				log_file=path.splitext(pdf_file)[0] + '.log',
+				timeout=Settings.compile_timeout,
+				memory=Settings.compile_memory)
+		except:
+			# an incomplete PDF must not be mistaken for a compiled figure or panel
+			if path.exists(pdf_file):
+				remove(pdf_file)
+			raise
+
+		if Settings.cache_dir:
+			cache.put(key, pdf_file)
 
 		return pdf_file
 
 
+	def _cache_key(self, directory, tex_file, children):
+		"""
+		Computes a hash of the LaTeX code, the compile command and all files
+		referenced by the LaTeX code.
+
+		@type  directory: string
+		@param directory: directory containing LaTeX code, images and data
+
+		@type  tex_file: string
+		@param tex_file: path to LaTeX file
+
+		@type  children: list
+		@param children: plots and images referenced by the LaTeX file
+
+		@rtype: string
+		@return: hexadecimal digest
+		"""
+
+		from plot import Plot
+		from surfplot import SurfPlot
+		from boxplot import BoxPlot
+
+		# plots whose data is stored in files
+		tables = [child for child in children
+			if isinstance(child, (Plot, SurfPlot, BoxPlot))
+			and (child.data_mode or self.data_mode) == 'table']
+
+		# names of data files depend on the session but the PDF does not
+		session = str(Figure._session)
+		references = {}
+		for child in tables:
+			reference = '{' + path.join(Settings.data_folder, child.filename()) + '}'
+			references[reference] = reference.replace(session, '', 1)
+
+		key = sha1(Settings.pdf_compile)
+
+		with open(tex_file) as handle:
+			for line in handle:
+				if references and 'table[' in line:
+					# only replace the reference at the end of \addplot ... table[...] {...};
+					reference = match(r'.*table\[[^\]]*\] (\{[^{}]*\})( \\closedcycle)?;$', line.rstrip('\n'))
+					if reference and reference.group(1) in references:
+						line = line[:reference.start(1)] + \
+							references[reference.group(1)] + line[reference.end(1):]
+				key.update(line)
+
+		# names of image files are hashes of their content, so only data is read
+		for child in tables:
+			filename = path.join(directory, Settings.data_folder, child.filename())
+
+			if not path.exists(filename):
+				continue
+
+			with open(filename, 'rb') as handle:
+				for block in iter(lambda: handle.read(1 << 20), ''):
+					key.update(block)
+
+		return key.hexdigest()
+
+
 	def draw(self):
 		"""
 		Compiles LaTeX code and tries to open the resulting PDF file.
@@ -202,14 +592,15 @@ class Figure(object):
 
 		if format == 'pdf':
 			# save PDF file
-			system('cp {0} {1}'.format(self.compile(), filename))
+			copyfile(self.compile(), filename)
 
 		elif format == 'tex':
 			self.save_images(path.dirname(filename))
+			self.save_data(path.dirname(filename))
 
 			# save TeX file
 			with open(filename, 'w') as handle:
-				handle.write(self.render())
+				self.render_to(handle)
 
 
 
@@ -219,18 +610,84 @@ class Figure(object):
 		if not path.exists(filepath):
 			mkdir(filepath)
 
-		# save figures
 		from image import Image
+		from plot import Plot
+
+		# identical images only need to be saved once
+		images = {}
+		for child in self._children():
+			if isinstance(child, Image):
+				images[child.filename()] = child
+			elif isinstance(child, Plot) and child.rasterize:
+				image = child._raster()
+				images[image.filename()] = image
+
+		if len(images) < 2:
+			for image in images.values():
+				image.save(filepath)
+			return
+
+		# PIL releases the global interpreter lock while encoding images
+		pool = ThreadPool(min(cpu_count(), len(images)))
+
+		try:
+			pool.map(lambda image: image.save(filepath), images.values())
+		finally:
+			pool.close()
+
+
+	def save_data(self, filepath):
+		"""
+		Writes the data of all plots rendered in 'table' mode into separate files.
+
+		@type  filepath: string
+		@param filepath: directory containing the LaTeX file
+		"""
+
+		from plot import Plot
+		from surfplot import SurfPlot
+		from boxplot import BoxPlot
+
+		filepath = path.join(filepath, Settings.data_folder)
+
+		for child in self._children():
+			if not isinstance(child, (Plot, SurfPlot, BoxPlot)):
+				continue
+			if (child.data_mode or self.data_mode) == 'table':
+				# make sure directory for data exists
+				if not path.exists(filepath):
+					mkdir(filepath)
+				child.save(filepath)
+
+
+	def _axes(self, axes=None, arrange=True):
+		"""
+		Returns all axes of this figure, including axes managed by an AxesGrid
+		and by AxesGrids nested inside other AxesGrids. Unless C{arrange} is
+		false, the AxesGrids also position their axes.
+		"""
+
 		from axesgrid import AxesGrid
-		from axes import Axes
-		for ax in self.axes:
+
+		if axes is None:
+			axes = self.axes
+
+		result = []
+		for ax in axes:
 			if isinstance(ax, AxesGrid):
-				for _, axs in ax.grid.iteritems():
-					for child in axs.children:
-						if isinstance(child, Image):
-							child.save(filepath)
-
-			elif isinstance(ax, Axes):
-				for child in ax.children:
-					if isinstance(child, Image):
-						child.save(filepath)
+				if arrange:
+					ax.arrange()
+				result.extend(self._axes((ax[key] for key in ax.keys()), arrange))
+			else:
+				result.append(ax)
+		return result
+
+
+	def _children(self):
+		"""
+		Iterates over all plots, images and other objects in this figure.
+		"""
+
+		for ax in self._axes():
+			for child in ax.children:
+				yield child
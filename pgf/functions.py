@@ -12,8 +12,13 @@ from text import Text
 from rectangle import Rectangle
 from circle import Circle
 from numpy import asmatrix, inf, min, copy, arange, repeat, isscalar, sum, ndarray
-from numpy import histogram, append, ceil
+from numpy import histogram, histogram2d, append, ceil, memmap
+from histogramaccumulator import HistogramAccumulator, value_range
 from image import Image
+from colormap import Colormap, colormaps
+from latex import CompileError
+from shutil import copyfile
+from itertools import izip
 
 def gcf():
 	"""
@@ -225,12 +230,19 @@ def barh(*args, **kwargs):
 
 def hist(values, bins=10, format_string='', range=None, normed=False, density=False, **kwargs):
 	"""
-	Computes and plots a histogram of the data provided.
+	Computes and plots a histogram of the data provided. Besides arrays, values
+	can be given as a memory-mapped array, an iterable of arrays or as a
+	L{HistogramAccumulator}. These are processed a chunk at a time, so that
+	the data never has to be loaded into memory at once. If no range is given,
+	an additional pass over the data determines the range, which requires that
+	the iterable can be iterated more than once.
 
 	B{Examples:}
 		>>> hist(x, 20, 'k')
+		>>> hist(load(filename, mmap_mode='r'), 50)
+		>>> hist((chunk for chunk in chunks), 50, range=(0., 1.))
 
-	@type  values: array_like
+	@type  values: array_like/iterable/HistogramAccumulator
 	@param values: values from which to compute a histogram
 
 	@type  bins: int
@@ -245,6 +257,9 @@ def hist(values, bins=10, format_string='', range=None, normed=False, density=Fa
 	@type  density: boolean
 	@param density: if true, the histogram is normalized to yield a density
 
+	@type  weights: array_like/iterable
+	@param weights: weight of each value, or an iterable of arrays of weights
+
 	@rtype: L{Plot}
 	@return: a reference to the plot
 	"""
@@ -262,11 +277,40 @@ def hist(values, bins=10, format_string='', range=None, normed=False, density=Fa
 			range = format_string
 		format_string = ''
 
-	try:
-		hist, bin_edges = histogram(values, bins, range, density=density)
-	except:
-		# use deprecated keyword with older versions of NumPy
-		hist, bin_edges = histogram(values, bins, range, normed=density)
+	weights = kwargs.pop('weights', None)
+
+	if isinstance(values, HistogramAccumulator):
+		hist, bin_edges = values.histogram(density)
+
+	elif isinstance(values, memmap) or not isinstance(values, (ndarray, list, tuple)) \
+		or len(values) and isinstance(values[0], ndarray) and values[0].ndim:
+		# process data a chunk at a time
+		chunks = [values] if isinstance(values, ndarray) else values
+
+		if isscalar(bins) and range is None:
+			if iter(chunks) is chunks:
+				raise ValueError('A range is required if data can only be iterated once.')
+			range = value_range(chunks)
+
+		accumulator = HistogramAccumulator(bins, range)
+
+		if weights is None:
+			for chunk in chunks:
+				accumulator.add(chunk)
+		else:
+			if isinstance(values, ndarray):
+				weights = [weights]
+			for chunk, weight in izip(chunks, weights):
+				accumulator.add(chunk, weight)
+
+		hist, bin_edges = accumulator.histogram(density)
+
+	else:
+		try:
+			hist, bin_edges = histogram(values, bins, range, density=density, weights=weights)
+		except:
+			# use deprecated keyword with older versions of NumPy
+			hist, bin_edges = histogram(values, bins, range, normed=density, weights=weights)
 
 	if normed:
 		hist = hist / sum(hist, dtype=float)
@@ -282,6 +326,69 @@ def hist(values, bins=10, format_string='', range=None, normed=False, density=Fa
 	return plot(bin_edges, hist, format_string, **kwargs)
 
 
+def hist2d(xvalues, yvalues, bins=100, range=None, density=False, weights=None, **kwargs):
+	"""
+	Counts data points in a two-dimensional grid of bins and shows the counts
+	as an image. Unlike plotting the points themselves, the cost of compiling
+	the figure does not depend on the number of data points.
+
+	B{Example:}
+		>>> hist2d(x, y, 200, cmap='jet')
+		>>> colorbar()
+
+	@type  xvalues: array_like
+	@param xvalues: x-coordinates of data points
+
+	@type  yvalues: array_like
+	@param yvalues: y-coordinates of data points
+
+	@type  bins: int/list
+	@param bins: number of bins, or number of bins along x and y
+
+	@type  range: list
+	@param range: lower and upper range of bins along x and y, e.g. [[0, 1], [0, 2]]
+
+	@type  density: boolean
+	@param density: if true, the histogram is normalized to yield a density
+
+	@type  weights: array_like
+	@param weights: optional weight of each data point
+
+	@type  cmap: string/Colormap
+	@param cmap: color map used to show counts; further arguments are passed to L{Image}
+
+	@rtype: L{Image}
+	@return: a reference to the image
+	"""
+
+	try:
+		counts, xedges, yedges = histogram2d(xvalues, yvalues, bins, range,
+			density=density, weights=weights)
+	except TypeError:
+		# use deprecated keyword with older versions of NumPy
+		counts, xedges, yedges = histogram2d(xvalues, yvalues, bins, range,
+			normed=density, weights=weights)
+
+	kwargs.setdefault('cmap', 'hot')
+	kwargs['limits'] = [xedges[0], xedges[-1], yedges[0], yedges[-1]]
+
+	# first row of image is shown at the top
+	img = Image(counts.T[::-1], **kwargs)
+
+	ax = kwargs.get('axes', gca())
+	ax.xmin, ax.xmax, ax.ymin, ax.ymax = img.limits()
+	ax.xtick_align = 'outside'
+	ax.ytick_align = 'outside'
+
+	# make sure color bar shows the same colors as the image
+	if isinstance(kwargs['cmap'], Colormap):
+		ax.colormap = kwargs['cmap']
+	else:
+		ax.colormap = colormaps[kwargs['cmap']]
+
+	return img
+
+
 def errorbar(*args, **kwargs):
 	"""
 	Plot lines or markers with error bars.
@@ -476,6 +583,70 @@ def savefig(filename, format=None):
 	gcf().save(filename, format)
 
 
+def savefig_async(filename, format=None, callback=None):
+	"""
+	Saves the currently active figure in the background. See L{Figure.save_async}.
+
+	@rtype: AsyncResult
+	@return: use C{get()} to wait for the figure to be saved
+	"""
+
+	return gcf().save_async(filename, format, callback)
+
+
+def compile_all(figures=None, workers=None):
+	"""
+	Compiles multiple figures in parallel. See L{Figure.compile_all}.
+
+	@rtype: list
+	@return: a tuple (pdf_file, error) for each figure
+	"""
+
+	return Figure.compile_all(figures, workers)
+
+
+def savefig_many(filenames, figures=None, workers=None):
+	"""
+	Compiles multiple figures in parallel and saves them as PDF files. A
+	figure which fails to compile does not prevent other figures from being
+	saved.
+
+	B{Example:}
+
+		>>> errors = savefig_many(['fig1.pdf', 'fig2.pdf'], workers=2)
+
+	@type  filenames: list
+	@param filenames: a PDF file location for each figure
+
+	@type  figures: list/None
+	@param figures: figures to save (default: all figures)
+
+	@type  workers: integer/None
+	@param workers: maximum number of figures compiled at the same time, see L{compile_all}
+
+	@rtype: list
+	@return: for each figure, the error which occurred or None
+	"""
+
+	if figures is None:
+		figures = [Figure._figures[idx] for idx in sorted(Figure._figures)]
+
+	if len(filenames) != len(figures):
+		raise ValueError('The number of file names should correspond to the number of figures.')
+
+	errors = []
+
+	for filename, (pdf_file, error) in zip(filenames, compile_all(figures, workers)):
+		if error is None:
+			try:
+				copyfile(pdf_file, filename)
+			except IOError as copy_error:
+				error = copy_error
+		errors.append(error)
+
+	return errors
+
+
 def box(value=None):
 	box_on = (gca().axis_x_line is None) and (gca().axis_y_line is None)
 	if value == 'off' or (value is None and box_on):
@@ -0,0 +1,156 @@
+from numpy import histogram, zeros, asarray, diff, isfinite, all, array_equal, ndarray, isscalar
+
+class HistogramAccumulator(object):
+	"""
+	Counts values in bins, processing the values one chunk at a time. Counts
+	of accumulators with the same bins can be merged, e.g. after collecting
+	data in several processes.
+
+	B{Example:}
+
+		>>> acc = HistogramAccumulator(50, range=(0., 1.))
+		>>> for chunk in chunks:
+		>>> 	acc.add(chunk)
+		>>> hist(acc)
+
+	@type edges: ndarray
+	@ivar edges: edges of bins
+
+	@type counts: ndarray
+	@ivar counts: number of values (or sum of weights) in each bin
+	"""
+
+	def __init__(self, bins=10, range=None):
+		"""
+		@type  bins: int/array_like
+		@param bins: number of bins or edges of bins
+
+		@type  range: tuple
+		@param range: lower and upper range of bins, required if bins is a number
+		"""
+
+		if isscalar(bins):
+			if range is None:
+				raise ValueError('A range is required if only the number of bins is given.')
+
+			# computes edges in the same way as NumPy
+			self.edges = histogram([], bins, range)[1]
+			self._bins, self._range = bins, range
+
+		else:
+			self.edges = asarray(bins, dtype=float)
+			self._bins, self._range = self.edges, None
+
+		self.counts = zeros(len(self.edges) - 1, dtype=int)
+
+
+	def add(self, values, weights=None, chunk_size=1 << 20):
+		"""
+		Counts values. Large arrays, e.g. memory-mapped arrays, are processed a
+		chunk at a time, so that they do not have to be loaded into memory.
+
+		@type  values: array_like
+		@param values: values to be counted
+
+		@type  weights: array_like
+		@param weights: optional weight of each value
+
+		@rtype: HistogramAccumulator
+		@return: this accumulator
+		"""
+
+		if not isinstance(values, ndarray):
+			values = asarray(values)
+		values = values.reshape(-1)
+
+		if weights is not None:
+			if not isinstance(weights, ndarray):
+				weights = asarray(weights)
+			weights = weights.reshape(-1)
+
+		for i in xrange(0, len(values), chunk_size):
+			self._add(histogram(
+				values[i:i + chunk_size],
+				self._bins,
+				self._range,
+				weights=None if weights is None else weights[i:i + chunk_size])[0])
+
+		return self
+
+
+	def merge(self, other):
+		"""
+		Adds the counts of another accumulator with the same bins.
+
+		@type  other: HistogramAccumulator
+		@param other: another accumulator
+
+		@rtype: HistogramAccumulator
+		@return: this accumulator
+		"""
+
+		if not array_equal(self.edges, other.edges):
+			raise ValueError('Only histograms with the same bins can be merged.')
+
+		self._add(other.counts)
+
+		return self
+
+
+	def _add(self, counts):
+		if counts.dtype.kind == 'f' and self.counts.dtype.kind != 'f':
+			# weighted counts
+			self.counts = self.counts.astype(float)
+		self.counts += counts
+
+
+	def histogram(self, density=False):
+		"""
+		Returns counts and bin edges like C{numpy.histogram}.
+
+		@type  density: boolean
+		@param density: if true, the histogram is normalized to yield a density
+
+		@rtype: tuple
+		@return: counts or densities and edges of bins
+		"""
+
+		if density:
+			return self.counts / diff(self.edges) / self.counts.sum(), self.edges
+		return self.counts.copy(), self.edges
+
+
+
+def value_range(chunks, chunk_size=1 << 20):
+	"""
+	Determines the smallest and largest value in a sequence of arrays, one
+	chunk at a time.
+
+	@type  chunks: iterable
+	@param chunks: arrays of values
+
+	@rtype: tuple
+	@return: smallest and largest value
+	"""
+
+	vmin, vmax = None, None
+
+	for values in chunks:
+		values = asarray(values).reshape(-1)
+
+		for i in xrange(0, len(values), chunk_size):
+			chunk = values[i:i + chunk_size]
+
+			if not len(chunk):
+				continue
+
+			vmin = chunk.min() if vmin is None else min(vmin, chunk.min())
+			vmax = chunk.max() if vmax is None else max(vmax, chunk.max())
+
+	if vmin is None:
+		return 0., 1.
+
+	if not all(isfinite([vmin, vmax])):
+		raise ValueError('Autodetected range of [{0}, {1}] is not finite.'.format(vmin, vmax))
+
+	return vmin, vmax
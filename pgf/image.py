@@ -1,10 +1,15 @@
 from PIL import Image as PILImage
-from numpy import ndarray, array, repeat, min, max, real
+from numpy import ndarray, array, asarray, empty, zeros, min, max, real, isnan, clip, ceil
+from numpy import concatenate
+from numpy.ma import MaskedArray, getmaskarray, getdata
 from utils import indent
 from axes import Axes
 from settings import Settings
-from os import path
-from colormap import colormaps
+from os import path, rename, remove, link, getpid
+from shutil import copyfileobj
+from threading import current_thread
+from hashlib import sha1
+from colormap import Colormap, colormaps
 
 class Image(object):
 	"""
@@ -13,16 +18,43 @@ class Image(object):
 
 	_counter = 0
 
+	# file extensions of supported formats
+	_extensions = {'PNG': 'png', 'PNG8': 'png', 'JPEG': 'jpg'}
+
 	def __init__(self, image, **kwargs):
 		"""
 		@type  image: string/array_like/PIL Image
 		@param image: a filepath or an image in grayscale or RGB
 
-		@param vmin:
+		@type  vmin: float
+		@param vmin: value mapped to the first color
+
+		@type  vmax: float
+		@param vmax: value mapped to the last color
+
+		@type  percentiles: tuple/None
+		@param percentiles: if given, vmin and vmax default to these percentiles of the pixel values
+
+		@type  cmap: string/Colormap
+		@param cmap: name of a built-in color map or a color map
+
+		@type  bad: list
+		@param bad: RGB color of masked pixels and pixels which are NaN
+
+		@type  max_dpi: float/None
+		@param max_dpi: if given, the image is downsampled when saved to at most this resolution
+
+		@type  resample: string
+		@param resample: downsampling method ('area' or 'nearest', e.g. for label maps)
+
+		@type  format: string
+		@param format: how the image is stored ('PNG', 'JPEG' or 'PNG8')
 
-		@param vmax:
+		@type  quality: integer
+		@param quality: quality of JPEG images between 1 and 95
 
-		@param cmap:
+		@type  compress_level: integer
+		@param compress_level: compression of PNG images between 0 and 9
 
 		@param xmin:
 		@param xmax:
@@ -30,41 +62,104 @@ class Image(object):
 		@param ymax:
 
 		@param limits:
+
+		@type  detached: bool
+		@param detached: if true, the image is not added to the axes, e.g. because it is rendered by a plot
 		"""
 
 		self._cmap = kwargs.get('cmap', 'gray')
+		self.bad = kwargs.get('bad', [255, 255, 255])
+
+		# resolution at which the image is stored
+		self.max_dpi = kwargs.get('max_dpi', None)
+		self.resample = kwargs.get('resample', 'area')
+
+		if self.resample not in ['area', 'nearest']:
+			raise ValueError('Unknown resampling method \'{0}\'.'.format(self.resample))
+
+		# how the image is encoded
+		self.format = kwargs.get('format', Settings.image_format).upper()
+		self.quality = kwargs.get('quality', Settings.image_quality)
+		self.compress_level = kwargs.get('compress_level', Settings.image_compress_level)
+
+		if self.format not in Image._extensions:
+			raise ValueError('Unknown image format \'{0}\'.'.format(self.format))
+
+		# range of pixel values
+		self.vmin = 0
+		self.vmax = 255
+
+		# image file given by the user
+		self._source = None
 
 		if isinstance(image, str):
+			# only reads the header, pixels are decoded when needed
 			self.image = PILImage.open(image)
+			self._source = image
+
+			if 'format' not in kwargs and self.image.format in ['PNG', 'JPEG']:
+				# keep format so that the file can be used as is
+				self.format = self.image.format
 
 		elif isinstance(image, PILImage.Image):
 			self.image = image.copy()
 
 		else:
+			# colors of images stored with color indices
+			palette = None
+
 			if isinstance(image, ndarray):
-				# copy array
-				image = array(image)
+				if image.ndim < 3:
+					if isinstance(self._cmap, Colormap):
+						colormap = self._cmap
+					else:
+						colormap = colormaps[self._cmap]
+					levels = len(colormap)
+				else:
+					levels = 256
+
+				# masked pixels
+				mask = getmaskarray(image) if isinstance(image, MaskedArray) else None
+
+				# avoids copying the data, e.g. of memory-mapped arrays
+				image = getdata(image)
+
+				rescale = image.dtype.kind not in ['u', 'i'] or 'vmin' in kwargs or 'vmax' in kwargs
+
+				if image.dtype.kind == 'b':
+					image = image.view('uint8')
+
+				if rescale:
+					if 'vmin' in kwargs and 'vmax' in kwargs:
+						vmin, vmax = None, None
+					else:
+						vmin, vmax = _value_range(image, mask, kwargs.get('percentiles', None))
 
-				if image.dtype.kind not in ['u', 'i']:
-					self.vmin = kwargs.get('vmin', min(image))
-					self.vmax = kwargs.get('vmax', max(image))
+					self.vmin = kwargs.get('vmin', vmin)
+					self.vmax = kwargs.get('vmax', vmax)
 
-					# rescale image
-					image = (image - self.vmin) / (self.vmax - self.vmin)
-					image = array(image * 256., dtype='int32')
+					image, missing = _quantize(image, mask, levels, self.vmin, self.vmax)
 
-				image[image < 0] = 0
-				image[image > 255] = 255
-				image = array(image, dtype='uint8')
+				else:
+					image, missing = _quantize(image, mask, levels)
 
 				if image.ndim < 3:
-					image = repeat(image.reshape(image.shape[0], -1, 1), 3, 2)
-					for i in range(image.shape[0]):
-						for j in range(image.shape[1]):
-							image[i, j, :] = colormaps[self._cmap][image[i, j, 0]]
+					if levels < 256 or levels == 256 and missing is None:
+						# keep color indices and store colors in a palette
+						if missing is not None:
+							image[missing] = levels
+						palette = concatenate([colormap.colors, [self.bad]])
+					else:
+						# look up colors of all pixels at once
+						image = colormap.colors[image]
+						if missing is not None:
+							image[missing] = self.bad
 
 			self.image = PILImage.fromarray(image)
 
+			if palette is not None:
+				self.image.putpalette(asarray(palette[:256], dtype='uint8').ravel().tolist())
+
 		# specify pixel coordinates 
 		self.xmin = kwargs.get('xmin', 0)
 		self.xmax = kwargs.get('xmax', self.image.size[0])
@@ -77,20 +172,178 @@ class Image(object):
 
 		# add image to axis
 		self.axes = kwargs.get('axes', Axes.gca())
-		self.axes.children.append(self)
+
+		if not kwargs.get('detached', False):
+			self.axes.children.append(self)
 
 		self.idx = Image._counter
 		Image._counter += 1
 
+		# hash of pixels, see filename()
+		self._digest = None
+
 
 	def filename(self):
-		return \
-			str(self.axes.figure._session) + '_' + \
-			str(self.idx) + '.' + Settings.image_format.lower()
+		"""
+		Images are stored under a hash of their pixels and format, so that
+		identical images are only encoded once.
+
+		@rtype: string
+		@return: name of image file
+		"""
+
+		size = self._output_size()
+
+		if self._digest is None or self._digest[0] is not self.image or self._digest[1] != size:
+			if self._passthrough():
+				key = sha1(self.format)
+
+				# hash file without decoding it
+				with open(self._source, 'rb') as handle:
+					for block in iter(lambda: handle.read(1 << 20), ''):
+						key.update(block)
+
+			else:
+				key = sha1(self.format + str(self._encoding()))
+				key.update(str((self.image.mode, self.image.size, size, self.resample)))
+				key.update(str(self.image.getpalette()))
+				key.update(self.image.tobytes())
+
+			# remember hash until image is replaced or resized
+			self._digest = (self.image, size, key.hexdigest())
+
+		return self._digest[2] + '.' + Image._extensions[self.format]
+
+
+	def _encoding(self):
+		"""
+		Returns the format and options passed to PIL when saving the image.
+		"""
+
+		if self.format == 'JPEG':
+			return 'JPEG', {'quality': self.quality}
+		return 'PNG', {'compress_level': self.compress_level}
+
+
+	def _passthrough(self):
+		"""
+		Tests whether the image file given by the user can be used unchanged.
+		"""
+
+		return self._source is not None \
+			and self.image.format == self.format \
+			and self._output_size() == self.image.size
+
+
+	def _output_size(self):
+		"""
+		Computes the size of the stored image, which is limited by the physical
+		size of the image in the axes and C{max_dpi}.
+
+		@rtype: tuple
+		@return: width and height in pixels
+		"""
+
+		width, height = self.image.size
+
+		if not self.max_dpi:
+			return width, height
+
+		# size of image in cm
+		w, h = self.axes.width, self.axes.height
+
+		if None not in [self.axes.xmin, self.axes.xmax] and self.axes.xmax != self.axes.xmin:
+			w *= min([1., abs(float(self.xmax - self.xmin) / (self.axes.xmax - self.axes.xmin))])
+		if None not in [self.axes.ymin, self.axes.ymax] and self.axes.ymax != self.axes.ymin:
+			h *= min([1., abs(float(self.ymax - self.ymin) / (self.axes.ymax - self.axes.ymin))])
+
+		return (
+			int(min([width, max([1., ceil(w / 2.54 * self.max_dpi)])])),
+			int(min([height, max([1., ceil(h / 2.54 * self.max_dpi)])])))
+
+
+	def _output(self):
+		"""
+		Returns the image as it is stored, downsampled if necessary.
+
+		@rtype: PIL Image
+		@return: image
+		"""
+
+		size = self._output_size()
+
+		if size == self.image.size:
+			return self.image
+
+		if self.resample == 'nearest':
+			return self.image.resize(size, PILImage.NEAREST)
+
+		image = self.image
+		if image.mode not in ['L', 'LA', 'RGB', 'RGBA', 'I', 'F']:
+			image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+
+		# average pixels in each area
+		return image.resize(size, PILImage.BOX)
 
 
 	def save(self, filepath=''):
-		self.image.save(path.join(filepath, self.filename()))
+		"""
+		Writes the image unless an identical image has already been written.
+
+		@type  filepath: string
+		@param filepath: directory in which the image is stored
+		"""
+
+		filename = path.join(filepath, self.filename())
+
+		if path.exists(filename):
+			return
+
+		if self._passthrough():
+			try:
+				# avoids copying the file
+				link(self._source, filename)
+				return
+			except OSError:
+				# different file systems or file was just saved by another thread
+				if path.exists(filename):
+					return
+
+		# write to temporary file so that other threads never see incomplete images
+		tmp_file = '{0}.{1}.{2}.tmp'.format(filename, getpid(), current_thread().ident)
+
+		try:
+			with open(tmp_file, 'wb') as handle:
+				if self._passthrough():
+					with open(self._source, 'rb') as source:
+						copyfileobj(source, handle)
+				else:
+					self._encode(handle)
+			rename(tmp_file, filename)
+		except:
+			if path.exists(tmp_file):
+				remove(tmp_file)
+			raise
+
+
+	def _encode(self, handle):
+		"""
+		Writes the image in the chosen format.
+
+		@type  handle: file
+		@param handle: file object to which the image is written
+		"""
+
+		image = self._output()
+
+		if self.format == 'JPEG' and image.mode not in ['L', 'RGB', 'CMYK']:
+			image = image.convert('RGB')
+		elif self.format == 'PNG8' and image.mode not in ['1', 'L', 'P']:
+			image = image.convert('RGB').convert('P', palette=PILImage.ADAPTIVE)
+
+		format, options = self._encoding()
+
+		image.save(handle, format, **options)
 
 
 	def render(self):
@@ -121,3 +374,129 @@ class Image(object):
 
 	def  height(self):
 		return self.image.size[1]
+
+
+
+def _value_range(image, mask=None, percentiles=None, chunk_size=1 << 20):
+	"""
+	Determines the range of pixel values, ignoring masked pixels and NaNs. The
+	image is processed a few rows at a time to avoid large temporary arrays.
+
+	@type  image: ndarray
+	@param image: pixel values
+
+	@type  mask: ndarray/None
+	@param mask: masked pixels
+
+	@type  percentiles: tuple/None
+	@param percentiles: lower and upper percentile, or None for minimum and maximum
+
+	@rtype: tuple
+	@return: smallest and largest value
+	"""
+
+	rows = max([1, chunk_size // max([1, image[:1].size])])
+	vmin, vmax = None, None
+
+	if percentiles is not None:
+		# valid pixel values
+		values = empty(image.size, dtype=image.dtype)
+		size = 0
+
+	for start in range(0, len(image), rows):
+		chunk = image[start:start + rows]
+		invalid = isnan(chunk)
+		if mask is not None:
+			invalid |= mask[start:start + rows]
+		chunk = chunk[~invalid]
+
+		if not chunk.size:
+			continue
+
+		if percentiles is None:
+			vmin = min(chunk) if vmin is None else min([vmin, min(chunk)])
+			vmax = max(chunk) if vmax is None else max([vmax, max(chunk)])
+		else:
+			values[size:size + chunk.size] = chunk
+			size += chunk.size
+
+	if percentiles is not None and size:
+		values = values[:size]
+
+		# ranks of percentiles
+		i, j = [int(round(p / 100. * (size - 1))) for p in percentiles]
+
+		# partially sorts values in place, which is faster than sorting
+		values.partition([i, j])
+		vmin, vmax = values[i], values[j]
+
+	if vmin is None:
+		return 0., 1.
+	return vmin, vmax
+
+
+def _quantize(image, mask, levels, vmin=None, vmax=None, chunk_size=1 << 20):
+	"""
+	Maps pixel values to color indices. The image is processed a few rows at a
+	time and the indices are written into a single preallocated array.
+
+	@type  image: ndarray
+	@param image: pixel values
+
+	@type  mask: ndarray/None
+	@param mask: masked pixels
+
+	@type  levels: integer
+	@param levels: number of colors
+
+	@type  vmin: float/None
+	@param vmin: value mapped to the first color; if None, values are clipped to [0, 255]
+
+	@type  vmax: float/None
+	@param vmax: value mapped to the last color
+
+	@rtype: tuple
+	@return: color indices and masked or missing pixels (or None)
+	"""
+
+	indices = empty(image.shape, dtype='uint8' if levels <= 256 else 'uint16')
+	missing = None
+
+	rows = max([1, chunk_size // max([1, image[:1].size])])
+
+	for start in range(0, len(image), rows):
+		chunk = image[start:start + rows]
+
+		if vmin is None:
+			invalid = None
+			chunk = clip(chunk, 0, 255)
+
+			if levels != 256:
+				chunk = asarray(chunk, dtype='int32') * levels // 256
+
+		else:
+			chunk = array(chunk, dtype=chunk.dtype if chunk.dtype.kind == 'f' else float)
+			invalid = isnan(chunk)
+
+		if mask is not None:
+			invalid = mask[start:start + rows] if invalid is None \
+				else invalid | mask[start:start + rows]
+
+		if invalid is not None and invalid.any():
+			if missing is None:
+				missing = zeros(image.shape, dtype=bool)
+			missing[start:start + rows] = invalid
+
+			if vmin is not None:
+				chunk[invalid] = vmin
+
+		if vmin is not None:
+			# rescale in place
+			chunk -= vmin
+			chunk /= vmax - vmin
+			chunk *= levels
+			clip(chunk, 0, levels - 1, out=chunk)
+
+		indices[start:start + rows] = chunk
+
+	return indices, missing
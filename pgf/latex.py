@@ -0,0 +1,231 @@
+from os import path, killpg
+from subprocess import Popen, PIPE, STDOUT
+from threading import Timer, BoundedSemaphore, Lock
+from multiprocessing import cpu_count
+from signal import SIGTERM, SIGKILL
+from shlex import split
+from pipes import quote
+from time import sleep
+from settings import Settings
+import sys
+
+# limits the number of LaTeX processes running at the same time, and the
+# limit it was created with
+_processes = None
+_processes_size = None
+_processes_lock = Lock()
+
+# starts a new process group and limits memory before running a command;
+# done in the new process rather than with preexec_fn, which is not safe to
+# use in a process with multiple threads
+_trampoline = """
+import os, sys, resource
+os.setsid()
+if sys.argv[1]:
+	resource.setrlimit(resource.RLIMIT_AS, (int(sys.argv[1]), int(sys.argv[1])))
+os.execvp(sys.argv[2], sys.argv[2:])
+"""
+
+class CompileError(RuntimeError):
+	"""
+	Raised if LaTeX code could not be compiled.
+
+	@type log_file: string/None
+	@ivar log_file: path to the log file written by LaTeX
+
+	@type errors: list
+	@ivar errors: error messages found in the log file
+
+	@type output: string
+	@ivar output: what LaTeX printed to the terminal
+
+	@type timeout: boolean
+	@ivar timeout: true if LaTeX was stopped because it took too long
+	"""
+
+	def __init__(self, message, log_file=None, errors=None, output='', timeout=False):
+		if errors:
+			message = message + '\n' + '\n'.join(errors)
+
+		RuntimeError.__init__(self, message)
+
+		self.log_file = log_file
+		self.errors = errors or []
+		self.output = output
+		self.timeout = timeout
+
+
+
+def latex_command(template, *args):
+	"""
+	Turns a command template such as C{Settings.pdf_compile} into a list of
+	arguments. Placeholders which stand alone are replaced by the given
+	arguments, so that file names do not have to be quoted. Templates relying
+	on the shell, e.g. by redirecting output, are returned as a string with
+	all arguments quoted.
+
+	@type  template: string
+	@param template: command with placeholders C{{0}}, C{{1}}, ...
+
+	@type  args: string/list
+	@param args: a string or a list of strings for each placeholder
+
+	@rtype: list/string
+	@return: list of arguments or shell command
+	"""
+
+	args = [[arg] if isinstance(arg, str) else list(arg) for arg in args]
+	tokens = split(template)
+
+	for token in tokens:
+		if token in ['|', '||', '&', '&&', ';'] or token.lstrip('012').startswith(('<', '>')):
+			# command needs to be run by the shell
+			return template.format(*[' '.join(quote(a) for a in arg) for arg in args])
+
+	command = []
+
+	for token in tokens:
+		for i, arg in enumerate(args):
+			if token == '{' + str(i) + '}':
+				command.extend(arg)
+				break
+		else:
+			command.append(token.format(*[' '.join(arg) for arg in args]))
+
+	return command
+
+
+def run_latex(command, directory, log_file=None, timeout=None, memory=None):
+	"""
+	Runs LaTeX or another command in a separate process and waits for it to
+	finish. The process and everything it started is killed if it runs for
+	too long.
+
+	@type  command: list/string
+	@param command: list of arguments or a shell command, see L{latex_command}
+
+	@type  directory: string
+	@param directory: working directory
+
+	@type  log_file: string/None
+	@param log_file: LaTeX log file, searched for error messages if compilation fails
+
+	@type  timeout: float/None
+	@param timeout: maximum time in seconds
+
+	@type  memory: integer/None
+	@param memory: maximum address space in bytes
+
+	@rtype: string
+	@return: output of the command
+	"""
+
+	if isinstance(command, str):
+		command = ['/bin/sh', '-c', command]
+
+	# new process group, so that all processes can be killed at once
+	command = [sys.executable, '-c', _trampoline, str(memory or '')] + command
+
+	with _semaphore():
+		return _run(command, directory, log_file, timeout)
+
+
+def _run(command, directory, log_file, timeout):
+	process = Popen(command,
+		cwd=directory,
+		stdin=PIPE,
+		stdout=PIPE,
+		stderr=STDOUT,
+		close_fds=True)
+
+	killed = []
+
+	def kill():
+		try:
+			killpg(process.pid, SIGTERM)
+			killed.append(True)
+			sleep(1.)
+			killpg(process.pid, SIGKILL)
+		except OSError:
+			# processes already finished
+			pass
+
+	timer = Timer(timeout, kill) if timeout is not None else None
+
+	if timer:
+		timer.start()
+
+	try:
+		# closes standard input, so that LaTeX cannot wait for user input
+		output, _ = process.communicate()
+	finally:
+		if timer:
+			timer.cancel()
+
+	if killed:
+		raise CompileError(
+			'Compiling TeX source file to PDF took longer than {0} seconds.'.format(timeout),
+			log_file, parse_log(log_file), output, True)
+
+	if process.returncode:
+		raise CompileError('Compiling TeX source file to PDF failed.',
+			log_file, parse_log(log_file), output)
+
+	return output
+
+
+def _semaphore():
+	"""
+	Returns the semaphore shared by all threads starting LaTeX processes. A
+	new semaphore is created if C{Settings.compile_processes} changed; runs
+	which already started are not counted against the new limit.
+	"""
+
+	global _processes, _processes_size
+
+	size = Settings.compile_processes or cpu_count()
+
+	with _processes_lock:
+		if _processes is None or _processes_size != size:
+			_processes = BoundedSemaphore(size)
+			_processes_size = size
+
+	return _processes
+
+
+def parse_log(log_file):
+	"""
+	Extracts error messages from a LaTeX log file, including the line of
+	LaTeX code which caused the error.
+
+	@type  log_file: string/None
+	@param log_file: path to log file
+
+	@rtype: list
+	@return: error messages
+	"""
+
+	if not log_file or not path.exists(log_file):
+		return []
+
+	errors = []
+
+	with open(log_file) as handle:
+		lines = handle.read().splitlines()
+
+	for i, line in enumerate(lines):
+		if line.startswith('!'):
+			error = [line]
+
+			# add context up to the offending line
+			for context in lines[i + 1:i + 10]:
+				if context.startswith('!'):
+					break
+				if context.strip():
+					error.append(context)
+				if context.startswith('l.'):
+					break
+
+			errors.append('\n'.join(error))
+
+	return errors
@@ -0,0 +1,108 @@
+from os import path, makedirs, rename, getpid
+from hashlib import sha1
+from fcntl import flock, LOCK_EX, LOCK_UN
+from subprocess import Popen, PIPE, STDOUT
+from shlex import split
+from settings import Settings
+from latex import latex_command, run_latex, CompileError
+
+# formats which could not be created in this session
+_failed = set()
+
+# version information of LaTeX programs
+_versions = {}
+
+def preamble_format(preamble):
+	"""
+	Returns a LaTeX format file containing a precompiled preamble, creating
+	the format first if necessary. Formats are stored in the cache directory
+	and identified by a hash of the preamble, so that figures with the same
+	preamble share a format.
+
+	@type  preamble: string
+	@param preamble: LaTeX code preceding C{\\begin{document}}
+
+	@rtype: string/None
+	@return: path to format file without extension, or None if no format could be created
+	"""
+
+	directory = Settings.cache_dir or Settings.tmp_dir
+
+	# formats cannot be loaded by other versions of LaTeX, e.g. after an update
+	name = 'pgf_' + sha1(Settings.pdf_format + _version(Settings.pdf_format) + preamble).hexdigest()
+	fmt_file = path.join(directory, name)
+
+	if path.exists(fmt_file + '.fmt'):
+		return fmt_file
+
+	if name in _failed:
+		return None
+
+	if not path.exists(directory):
+		try:
+			makedirs(directory)
+		except OSError:
+			if not path.isdir(directory):
+				raise
+
+	with open(fmt_file + '.lock', 'a') as lock:
+		# only one process creates the format
+		flock(lock, LOCK_EX)
+
+		try:
+			if not path.exists(fmt_file + '.fmt'):
+				with open(fmt_file + '.tex', 'w') as handle:
+					handle.write(preamble)
+					handle.write('\\begin{document}\n\\end{document}\n')
+
+				# write to temporary file so that other processes never see incomplete formats
+				jobname = '{0}_{1}'.format(name, getpid())
+				command = latex_command(Settings.pdf_format, jobname, name + '.tex')
+
+				try:
+					run_latex(command, directory,
+						timeout=Settings.compile_timeout,
+						memory=Settings.compile_memory)
+				except CompileError:
+					pass
+
+				if not path.exists(path.join(directory, jobname + '.fmt')):
+					_failed.add(name)
+					return None
+
+				rename(path.join(directory, jobname + '.fmt'), fmt_file + '.fmt')
+		finally:
+			flock(lock, LOCK_UN)
+
+	return fmt_file
+
+
+def _version(command):
+	"""
+	Returns the version information printed by the program of a command.
+
+	@type  command: string
+	@param command: command template such as C{Settings.pdf_format}
+
+	@rtype: string
+	@return: output of the program's C{--version} option, or an empty string
+	"""
+
+	tokens = split(command)
+	program = tokens[0] if tokens else ''
+
+	if program not in _versions:
+		try:
+			process = Popen([program, '--version'],
+				stdin=PIPE,
+				stdout=PIPE,
+				stderr=STDOUT,
+				close_fds=True)
+			output, _ = process.communicate()
+		except OSError:
+			# program not found
+			output = ''
+
+		_versions[program] = output
+
+	return _versions[program]
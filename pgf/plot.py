@@ -1,9 +1,17 @@
-from numpy import asarray, arange, min, max, shape, zeros
+from numpy import asarray, arange, min, max, shape, zeros, log10, errstate
+from numpy import isfinite, flatnonzero, ceil
 from axes import Axes
 from string import replace
 from re import match
 from rgb import RGB
-from utils import indent
+from utils import indent, write_coordinates, write_table
+from StringIO import StringIO
+from settings import Settings
+from os import path
+from hashlib import sha1
+from decimate import lttb, minmax, douglas_peucker, visible, is_sorted
+from image import Image
+import raster
 
 class Plot(object):
 	"""
@@ -90,10 +98,30 @@ class Plot(object):
 	@type pgf_options: list
 	@ivar pgf_options: custom PGFPlots plot options
 
+	@type decimate: string/None
+	@ivar decimate: reduce data points before rendering ('lttb', 'minmax' or 'douglas_peucker')
+
+	@type decimate_tolerance: float
+	@ivar decimate_tolerance: largest deviation in pixels allowed by 'douglas_peucker'
+
+	@type decimate_dpi: float
+	@ivar decimate_dpi: resolution used to determine the number of pixels covered by the axes
+
+	@type data_mode: string/None
+	@ivar data_mode: 'inline' or 'table'; if None, the figure's data mode is used
+
+	@type rasterize: boolean
+	@ivar rasterize: if true, lines, markers and filled areas are drawn into an image
+
+	@type rasterize_dpi: float
+	@ivar rasterize_dpi: resolution of the image
+
 	@type comment: string
 	@ivar comment: can be used to put a comment into the LaTeX code
 	"""
 
+	_counter = 0
+
 	def __init__(self, *args, **kwargs):
 		"""
 		Initializes plot properties.
@@ -163,6 +191,31 @@ class Plot(object):
 		if not isinstance(self.pgf_options, list):
 			raise TypeError('pgf_options should be a list.')
 
+		# reduce number of data points at render time
+		self.decimate = kwargs.get('decimate', None)
+		self.decimate_tolerance = kwargs.get('decimate_tolerance', 0.5)
+		self.decimate_dpi = kwargs.get('decimate_dpi', Settings.decimate_dpi)
+
+		if self.decimate not in [None, 'lttb', 'minmax', 'douglas_peucker']:
+			raise ValueError('Unknown decimation strategy \'{0}\'.'.format(self.decimate))
+
+		# store data inside or outside of the LaTeX file
+		self.data_mode = kwargs.get('data_mode', None)
+
+		if self.data_mode not in [None, 'inline', 'table']:
+			raise ValueError('Unknown data mode \'{0}\'.'.format(self.data_mode))
+
+		# draw data into an image instead of rendering it with PGFPlots
+		self.rasterize = kwargs.get('rasterize', False)
+		self.rasterize_dpi = kwargs.get('rasterize_dpi', Settings.rasterize_dpi)
+
+		if self.rasterize:
+			# no data files are needed
+			self.data_mode = 'inline'
+
+		# image drawn by _raster()
+		self._raster_cache = None
+
 		# comment LaTeX code
 		self.comment = kwargs.get('comment', '')
 
@@ -170,6 +223,9 @@ class Plot(object):
 		self.axes = kwargs.get('axes', Axes.gca())
 		self.axes.children.append(self)
 
+		self.idx = Plot._counter
+		Plot._counter += 1
+
 
 	def render(self):
 		"""
@@ -179,6 +235,19 @@ class Plot(object):
 		@return: LaTeX code for this plot
 		"""
 
+		stream = StringIO()
+		self.render_to(stream)
+		return stream.getvalue()
+
+
+	def render_to(self, stream):
+		"""
+		Writes LaTeX code for this plot to a file or other stream.
+
+		@type  stream: file
+		@param stream: a file-like object
+		"""
+
 		options = []
 		marker_options = []
 		error_options = []
@@ -274,38 +343,308 @@ class Plot(object):
 			options_string = '\n' + indent(',\n'.join(options))
 
 		tex = '% ' + self.comment + '\n' if self.comment else ''
-		if options_string:
-			tex += '\\addplot+[{0}] coordinates {{\n'.format(options_string)
+
+		if self.rasterize:
+			tex += self._raster().render()
+
+			if self.legend_entry is not None:
+				# legend shows style of vector plot
+				if self.color is None:
+					options.append(self._raster_color())
+				tex += '\\addlegendimage{{{0}}}\n'.format(', '.join(options))
+
+		elif options_string:
+			tex += '\\addplot+[{0}] '.format(options_string)
 		else:
-			tex += '\\addplot coordinates {\n'
+			tex += '\\addplot '
+
+		if self.rasterize:
+			pass
+
+		elif (self.data_mode or self.axes.figure.data_mode) == 'table':
+			table_options = ['x index=0', 'y index=1']
+
+			if len(self.xvalues_error) or len(self.yvalues_error):
+				table_options.append('x error index=2')
+				table_options.append('y error index=3')
+			elif self.labels:
+				table_options.append('meta index=2')
+			table_options.append('header=false')
+
+			# refer to data file
+			tex += 'table[{0}] {{{1}}}'.format(', '.join(table_options),
+				path.join(Settings.data_folder, self.filename()))
+
+			if self.closed:
+				tex += ' \\closedcycle;\n'
+			else:
+				tex += ';\n'
+		else:
+			stream.write(tex + 'coordinates {\n')
+			write_coordinates(stream, *self._columns())
+
+			if self.closed:
+				tex = '} \\closedcycle;\n'
+			else:
+				tex = '};\n'
+
+		if self.legend_entry is not None:
+			tex += '\\addlegendentry{{{0}}};\n'.format(
+				self.legend_entry.replace('_', '\\_'))
+
+		stream.write(tex)
+
+
+	def _columns(self):
+		"""
+		Returns data point coordinates, error bars and labels.
+		"""
+
+		xvalues, yvalues = self.xvalues, self.yvalues
+		labels = self.labels
+
+		indices = self._decimate()
+
+		if indices is not None:
+			xvalues, yvalues = xvalues[indices], yvalues[indices]
+			if labels:
+				labels = [labels[i] for i in indices]
 
 		if len(self.xvalues_error) or len(self.yvalues_error):
 			x_error = self.xvalues_error if len(self.xvalues_error) \
 				else zeros(shape(self.yvalues_error))
 			y_error = self.yvalues_error if len(self.yvalues_error) \
 				else zeros(shape(self.xvalues_error))
+			if indices is not None:
+				x_error, y_error = x_error[indices], y_error[indices]
+			return [xvalues, yvalues], [x_error, y_error], None
 
-			# render plot with error bars
-			for x, y, e, f in zip(self.xvalues, self.yvalues, x_error, y_error):
-				tex += '\t({0}, {1}) +- ({2}, {3})\n'.format(x, y, e, f)
-		else:
-			# render plot coordinates
-			if self.labels:
-				for x, y, l in zip(self.xvalues, self.yvalues, self.labels):
-					tex += '\t({0}, {1}) [{2}]\n'.format(x, y, l)
+		if labels:
+			return [xvalues, yvalues], None, labels
+
+		return [xvalues, yvalues], None, None
+
+
+	def _decimate(self):
+		"""
+		Selects the data points which will be rendered, taking into account the
+		size and limits of the axes. The data stored in the plot is not changed.
+
+		@rtype: ndarray/None
+		@return: indices of data points or None if all points are rendered
+		"""
+
+		if not self.decimate or len(self.xvalues) < 3:
+			return None
+
+		xvalues = asarray(self.xvalues, dtype=float)
+		yvalues = asarray(self.yvalues, dtype=float)
+		xmin, xmax = self.axes.xmin, self.axes.xmax
+		ymin, ymax = self.axes.ymin, self.axes.ymax
+
+		# work in the coordinate system of the axes
+		with errstate(divide='ignore', invalid='ignore'):
+			if self.axes.axes_type in ['semilogxaxis', 'loglogaxis']:
+				xvalues = log10(xvalues)
+				xmin = None if xmin is None else log10(xmin)
+				xmax = None if xmax is None else log10(xmax)
+			if self.axes.axes_type in ['semilogyaxis', 'loglogaxis']:
+				yvalues = log10(yvalues)
+				ymin = None if ymin is None else log10(ymin)
+				ymax = None if ymax is None else log10(ymax)
+
+		# PGFPlots discards points which are not finite
+		valid = flatnonzero(isfinite(xvalues) & isfinite(yvalues))
+		xvalues, yvalues = xvalues[valid], yvalues[valid]
+
+		# ignore data points outside of the axes
+		if is_sorted(xvalues):
+			start, end = visible(xvalues, xmin, xmax)
+			xvalues, yvalues = xvalues[start:end], yvalues[start:end]
+			valid = valid[start:end]
+
+		if not len(xvalues):
+			return valid
+
+		# size of axes in pixels
+		width = self.axes.width / 2.54 * self.decimate_dpi
+		height = self.axes.height / 2.54 * self.decimate_dpi
+
+		if xmin is None:
+			xmin = min(xvalues)
+		if xmax is None:
+			xmax = max(xvalues)
+		if ymin is None:
+			ymin = min(yvalues)
+		if ymax is None:
+			ymax = max(yvalues)
+
+		if self.decimate == 'lttb':
+			indices = lttb(xvalues, yvalues, int(2 * width))
+
+		elif self.decimate == 'minmax':
+			if is_sorted(xvalues):
+				indices = minmax(xvalues, yvalues, int(width), xmin, xmax)
 			else:
-				for x, y in zip(self.xvalues, self.yvalues):
-					tex += '\t({0}, {1})\n'.format(x, y)
-		if self.closed:
-			tex += '} \\closedcycle;\n'
+				indices = arange(len(xvalues))
+
 		else:
-			tex += '};\n'
+			# measure distances in pixels
+			indices = douglas_peucker(
+				(xvalues - xmin) / (xmax - xmin if xmax > xmin else 1.) * width,
+				(yvalues - ymin) / (ymax - ymin if ymax > ymin else 1.) * height,
+				self.decimate_tolerance)
 
-		if self.legend_entry is not None:
-			tex += '\\addlegendentry{{{0}}};\n'.format(
-				self.legend_entry.replace('_', '\\_'))
+		return valid[indices]
+
+
+	def _raster(self):
+		"""
+		Draws lines, markers and filled areas into an image covering the data
+		points. The image is redrawn only if the data or the size of the axes
+		changed.
+
+		@rtype: L{Image}
+		@return: image which can be rendered in place of the plot
+		"""
+
+		axes = self.axes
+		dpi = float(self.rasterize_dpi)
+
+		# data may have been replaced or changed in place
+		digest = sha1()
+		for values in [self.xvalues, self.yvalues]:
+			values = asarray(values, dtype=float)
+			digest.update(str(values.shape))
+			digest.update(values.tobytes())
+
+		key = (digest.digest(), dpi, axes.width, axes.height,
+			axes.xmin, axes.xmax, axes.ymin, axes.ymax, axes.axes_type,
+			bool(axes.cycle_list or axes.cycle_list_name), str(self._raster_color()),
+			str(self.fill), self.opacity, self.line_style, self.line_width,
+			self.marker, self.marker_size, self.const_plot)
+
+		if self._raster_cache is not None and self._raster_cache[0] == key:
+			return self._raster_cache[1]
+
+		xlog = axes.axes_type in ['semilogxaxis', 'loglogaxis']
+		ylog = axes.axes_type in ['semilogyaxis', 'loglogaxis']
+
+		# image is drawn in the coordinate system PGFPlots uses internally
+		with errstate(divide='ignore', invalid='ignore'):
+			xvalues = asarray(self.xvalues, dtype=float)
+			yvalues = asarray(self.yvalues, dtype=float)
+			if xlog:
+				xvalues = log10(xvalues)
+			if ylog:
+				yvalues = log10(yvalues)
+
+		valid = isfinite(xvalues) & isfinite(yvalues)
+
+		# sizes in pixels
+		line_width = (self.line_width or .4) / 72.27 * dpi
+		marker_radius = 2. * (self.marker_size or 1.) / 72.27 * dpi
+		padding = int(ceil(max([line_width / 2., marker_radius if self.marker else 0.]))) + 1
+
+		def extent(vmin, vmax, values, log, size):
+			"""
+			Returns limits and number of pixels along one axis.
+			"""
+
+			if vmin is not None and vmax is not None:
+				if log:
+					vmin, vmax = log10(vmin), log10(vmax)
+				pixels = max([int(size / 2.54 * dpi + .5), 1])
+				return float(vmin), float(vmax), pixels
+
+			# axis limits are determined by PGFPlots, so cover the data points
+			vmin, vmax = (min(values), max(values)) if len(values) else (0., 1.)
+			if vmin == vmax:
+				vmin, vmax = vmin - .5, vmax + .5
+
+			pixels = max([int(size / 2.54 * dpi + .5), 1])
+			step = (vmax - vmin) / pixels
+			return vmin - padding * step, vmax + padding * step, pixels + 2 * padding
+
+		x0, x1, width = extent(axes.xmin, axes.xmax, xvalues[valid], xlog, axes.width)
+		y0, y1, height = extent(axes.ymin, axes.ymax, yvalues[valid], ylog, axes.height)
+
+		# pixel coordinates, with the origin in the upper left corner
+		xpixels = (xvalues - x0) / (x1 - x0) * width
+		ypixels = (y1 - yvalues) / (y1 - y0) * height
+
+		if self.const_plot:
+			xpixels, ypixels = raster.steps(xpixels, ypixels)
+
+		rgb = raster.color(self._raster_color())
+
+		fill = None
+		if self.fill:
+			fill = raster.color(self.fill) \
+				if isinstance(self.fill, str) or isinstance(self.fill, RGB) else rgb
+
+		# PGFPlots does not connect data points by default if markers are shown
+		lines = self.line_style not in ['only marks', 'none'] and \
+			(self.line_style or not self.marker or axes.cycle_list or axes.cycle_list_name)
+
+		image = raster.draw((width, height), xpixels, ypixels, rgb,
+			opacity=self.opacity,
+			line_width=line_width if lines else None,
+			marker=replace(self.marker, '.', '*') if self.marker else None,
+			marker_radius=marker_radius,
+			fill=fill,
+			baseline=(y1 - (y0 if ylog else 0.)) / (y1 - y0) * height)
+
+		limits = [x0, x1, y0, y1]
+		if xlog:
+			limits[:2] = [10. ** v for v in limits[:2]]
+		if ylog:
+			limits[2:] = [10. ** v for v in limits[2:]]
+
+		self._raster_cache = key, Image(image, axes=axes, limits=limits, detached=True)
+
+		return self._raster_cache[1]
+
+
+	def _raster_color(self):
+		"""
+		Returns the color of a rasterized plot, approximating PGFPlots' default
+		cycle list if no color was given.
+		"""
+
+		if isinstance(self.color, RGB) or isinstance(self.color, str):
+			return self.color
+
+		plots = [child for child in self.axes.children if isinstance(child, Plot)]
+		index = plots.index(self) if self in plots else 0
+
+		return ['blue', 'red', 'brown!60!black', 'black'][index % 4]
+
+
+	def filename(self):
+		return \
+			str(self.axes.figure._session) + '_plot_' + \
+			str(self.idx) + '.dat'
+
+
+	def save(self, filepath=''):
+		"""
+		Writes data points into a whitespace-separated data file.
+
+		@type  filepath: string
+		@param filepath: directory in which the data file is stored
+		"""
+
+		columns, errors, labels = self._columns()
+
+		if errors is not None:
+			columns = columns + errors
+		elif labels is not None:
+			# protect labels containing whitespace
+			columns = columns + [['{' + str(l) + '}' for l in labels]]
 
-		return tex
+		with open(path.join(filepath, self.filename()), 'w') as handle:
+			write_table(handle, columns)
 
 
 	def limits(self):
@@ -0,0 +1,180 @@
+from numpy import asarray, arange, zeros, empty, round, sqrt, abs, maximum, isfinite, concatenate
+from PIL import Image as PILImage, ImageDraw
+from rgb import RGB
+
+# xcolor's base colors
+_colors = {
+	'red': (255, 0, 0),
+	'green': (0, 255, 0),
+	'blue': (0, 0, 255),
+	'cyan': (0, 255, 255),
+	'magenta': (255, 0, 255),
+	'yellow': (255, 255, 0),
+	'black': (0, 0, 0),
+	'white': (255, 255, 255),
+	'gray': (128, 128, 128),
+	'darkgray': (64, 64, 64),
+	'lightgray': (191, 191, 191),
+	'brown': (191, 128, 64),
+	'lime': (191, 255, 0),
+	'olive': (128, 128, 0),
+	'orange': (255, 128, 0),
+	'pink': (255, 191, 191),
+	'purple': (191, 0, 64),
+	'teal': (0, 128, 128),
+	'violet': (128, 0, 128),
+}
+
+def color(value):
+	"""
+	Converts a color in xcolor notation, e.g. 'red' or 'blue!30!black', or an
+	L{RGB} instance into RGB values.
+
+	@type  value: string/L{RGB}
+	@param value: color
+
+	@rtype: tuple
+	@return: red, green and blue value between 0 and 255
+	"""
+
+	if isinstance(value, RGB):
+		scale = 1. if value.type == int else 255.
+		return tuple(int(c * scale + .5) for c in [value.red, value.green, value.blue])
+
+	parts = str(value).strip().split('!')
+	result = asarray(_colors.get(parts[0], (0, 0, 0)), dtype=float)
+
+	# mix colors, e.g. red!30 is 30% red and 70% white
+	for i in range(1, len(parts), 2):
+		other = asarray(_colors.get(parts[i + 1], (0, 0, 0)) if i + 1 < len(parts) \
+			else _colors['white'], dtype=float)
+		weight = float(parts[i]) / 100.
+		result = weight * result + (1. - weight) * other
+
+	return tuple(int(c + .5) for c in result)
+
+
+def steps(xvalues, yvalues):
+	"""
+	Turns data points into the corners of a piecewise constant line, where
+	each value is kept until the next data point.
+
+	@rtype: tuple
+	@return: x- and y-coordinates of corners
+	"""
+
+	if len(xvalues) < 2:
+		return xvalues, yvalues
+
+	xsteps = empty(2 * len(xvalues) - 1)
+	ysteps = empty(2 * len(yvalues) - 1)
+	xsteps[0::2] = xvalues
+	xsteps[1::2] = xvalues[1:]
+	ysteps[0::2] = yvalues
+	ysteps[1::2] = yvalues[:-1]
+
+	return xsteps, ysteps
+
+
+def stamp(marker, radius):
+	"""
+	Returns the pixel offsets covered by a marker.
+
+	@type  marker: string
+	@param marker: marker in PGFPlots notation, e.g. '*', 'o', 'square*', '+' or 'x'
+
+	@type  radius: float
+	@param radius: size of the marker in pixels
+
+	@rtype: tuple
+	@return: horizontal and vertical offsets
+	"""
+
+	r = max(int(round(radius)), 1)
+	dx, dy = [offsets.ravel() for offsets in [
+		arange(-r, r + 1)[None, :] + zeros((2 * r + 1, 1), dtype=int),
+		arange(-r, r + 1)[:, None] + zeros((1, 2 * r + 1), dtype=int)]]
+
+	distance = sqrt(dx ** 2 + dy ** 2)
+
+	if marker in ['square', 'square*']:
+		keep = (maximum(abs(dx), abs(dy)) == r) if marker == 'square' else distance >= 0
+	elif marker == '+':
+		keep = (dx == 0) | (dy == 0)
+	elif marker == 'x':
+		keep = abs(dx) == abs(dy)
+	elif marker in ['o', 'circle']:
+		keep = abs(distance - r) < .75
+	else:
+		keep = distance <= r + .25
+
+	return dx[keep], dy[keep]
+
+
+def draw(size, xvalues, yvalues, rgb, opacity=None, line_width=None,
+		marker=None, marker_radius=None, fill=None, baseline=None):
+	"""
+	Draws lines, markers and filled areas into an image with a transparent
+	background. Coordinates are given in pixels.
+
+	@type  size: tuple
+	@param size: width and height of the image
+
+	@type  rgb: tuple
+	@param rgb: color of lines and markers
+
+	@type  line_width: float/None
+	@param line_width: width of lines in pixels, or None if no lines are drawn
+
+	@type  marker: string/None
+	@param marker: marker in PGFPlots notation
+
+	@type  fill: tuple/None
+	@param fill: color of area between line and baseline
+
+	@type  baseline: float/None
+	@param baseline: vertical pixel coordinate the filled area extends to
+
+	@rtype: PIL Image
+	@return: image in RGBA mode
+	"""
+
+	image = PILImage.new('RGBA', size, (0, 0, 0, 0))
+	canvas = ImageDraw.Draw(image)
+
+	# PGFPlots discards points which are not finite
+	valid = isfinite(xvalues) & isfinite(yvalues)
+	xvalues, yvalues = asarray(xvalues)[valid], asarray(yvalues)[valid]
+
+	if fill is not None and len(xvalues) > 1:
+		polygon = concatenate([
+			[[xvalues[0], baseline]],
+			concatenate([xvalues[:, None], yvalues[:, None]], 1),
+			[[xvalues[-1], baseline]]])
+		canvas.polygon(polygon.ravel().tolist(), fill=tuple(fill) + (255,))
+
+	if line_width is not None and len(xvalues) > 1:
+		canvas.line(concatenate([xvalues[:, None], yvalues[:, None]], 1).ravel().tolist(),
+			fill=tuple(rgb) + (255,), width=max(int(round(line_width)), 1))
+
+	if marker is not None and len(xvalues):
+		pixels = asarray(image)
+
+		# place marker at each data point, one offset at a time
+		x, y = asarray(round(xvalues), dtype=int), asarray(round(yvalues), dtype=int)
+		mask = zeros(pixels.shape[:2], dtype=bool)
+		for dx, dy in zip(*stamp(marker, marker_radius)):
+			i, j = y + dy, x + dx
+			inside = (i >= 0) & (i < size[1]) & (j >= 0) & (j < size[0])
+			mask[i[inside], j[inside]] = True
+
+		pixels = pixels.copy()
+		pixels[mask] = tuple(rgb) + (255,)
+		image = PILImage.fromarray(pixels, 'RGBA')
+
+	if opacity is not None:
+		pixels = asarray(image).copy()
+		pixels[:, :, 3] = pixels[:, :, 3] * opacity + .5
+		image = PILImage.fromarray(pixels, 'RGBA')
+
+	return image
@@ -5,7 +5,32 @@ class Settings(object):
 	tmp_dir = '/tmp/'
 
 	# how to compile LaTeX code into PDFs
-	pdf_compile = 'pdflatex -halt-on-error -interaction batchmode {0} > /dev/null'
+	pdf_compile = 'pdflatex -halt-on-error -interaction batchmode {0}'
+
+	# maximum time in seconds and memory in bytes a LaTeX run may take up
+	compile_timeout = None
+	compile_memory = None
+
+	# maximum number of LaTeX processes running at the same time (None: number of CPUs)
+	compile_processes = None
+
+	# where compiled PDFs are kept to be reused if neither the LaTeX code nor
+	# images or data have changed (None disables caching), and maximum size of
+	# the cache in bytes; the cache is kept in a directory of the user, so
+	# that other users cannot place files in it
+	cache_dir = os.path.join(os.environ.get('XDG_CACHE_HOME') or \
+		os.path.expanduser('~/.cache'), 'pypgf', '')
+	cache_size = 256 * 1024 * 1024
+
+	# precompile the preamble into a format file which is reused by figures
+	# with the same preamble (requires the mylatexformat package), and how to
+	# create such a format
+	preamble_format = False
+	pdf_format = 'pdflatex -ini -interaction batchmode -jobname={0} "&pdflatex" mylatexformat.ltx {1}'
+
+	# compile each axes into a separate PDF file, so that axes which did not
+	# change need not be compiled again
+	externalize = False
 
 	# how to open and show PDFs
 	pdf_view_mac = 'open {0}'
@@ -13,9 +38,23 @@ class Settings(object):
 	pdf_view = pdf_view_mac if os.uname()[0] in ['Darwin'] \
 		else pdf_view_linux
 
-	# where and how images used in the figures will be stored
+	# where and how images used in the figures will be stored; the format can
+	# be 'PNG', 'JPEG' or 'PNG8' (PNG with a palette of at most 256 colors)
 	image_folder = 'images'
 	image_format = 'PNG'
+	image_quality = 90
+	image_compress_level = 6
+
+	# whether plot data is written into the LaTeX file ('inline') or into
+	# separate data files ('table'), and where those files will be stored
+	data_mode = 'inline'
+	data_folder = 'data'
+
+	# resolution assumed when reducing the number of data points of plots
+	decimate_dpi = 300
+
+	# resolution of plots drawn as images instead of vector graphics
+	rasterize_dpi = 300
 
 	# will be included in header of LaTeX file
 	preamble = \
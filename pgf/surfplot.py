@@ -1,16 +1,26 @@
 from axes import Axes
-from numpy import meshgrid, arange
+from numpy import broadcast_arrays, arange, asarray, around, linspace, ix_, allclose, diff, all
+from utils import write_coordinates, write_table
+from StringIO import StringIO
+from settings import Settings
+from os import path
 
 class SurfPlot(object):
 	"""
 	Renders basic 3D surfaces.
+
+	@type max_mesh: tuple/None
+	@ivar max_mesh: maximum number of rows and columns of the rendered mesh
 	"""
 
+	_counter = 0
+
 	def __init__(self, *args, **kwargs):
 		if len(args) == 1:
-			self.xvalues, self.yvalues = meshgrid(
-				arange(args[0].shape[0]),
-				arange(args[0].shape[1]))
+			# grid is not stored explicitly
+			self.xvalues, self.yvalues = broadcast_arrays(
+				arange(args[0].shape[1])[None, :],
+				arange(args[0].shape[0])[:, None])
 			self.zvalues = args[0]
 		else:
 			self.xvalues, self.yvalues, self.zvalues = args
@@ -18,6 +28,9 @@ class SurfPlot(object):
 		# shading
 		self.shading = kwargs.get('shading', None)
 
+		# reduce resolution of large meshes
+		self.max_mesh = kwargs.get('max_mesh', None)
+
 		# custom plot options
 		self.pgf_options = kwargs.get('pgf_options', [])
 
@@ -25,10 +38,19 @@ class SurfPlot(object):
 		if not isinstance(self.pgf_options, list):
 			raise TypeError('pgf_options should be a list.')
 
+		# store data inside or outside of the LaTeX file
+		self.data_mode = kwargs.get('data_mode', None)
+
+		if self.data_mode not in [None, 'inline', 'table']:
+			raise ValueError('Unknown data mode \'{0}\'.'.format(self.data_mode))
+
 		# add plot to axis
 		self.axes = kwargs.get('axes', Axes.gca())
 		self.axes.children.append(self)
 
+		self.idx = SurfPlot._counter
+		SurfPlot._counter += 1
+
 		# adjust default behavior for 3D plots
 		self.axes.axis_on_top = False
 		self.axes.xlabel_near_ticks = False
@@ -37,19 +59,124 @@ class SurfPlot(object):
 
 
 	def render(self):
+		stream = StringIO()
+		self.render_to(stream)
+		return stream.getvalue()
+
+
+	def render_to(self, stream):
+		xvalues, yvalues, zvalues = self._mesh()
+
 		options = ['surf']
-		options.append('mesh/rows={0}'.format(self.zvalues.shape[0]))
+		options.append('mesh/rows={0}'.format(zvalues.shape[0]))
 
 		if self.shading:
 			options.append('shader={0}'.format(self.shading))
 
-		options_string = ','.join(options)
+		if (self.data_mode or self.axes.figure.data_mode) == 'table':
+			filename = path.join(Settings.data_folder, self.filename())
+			grid = self._grid(xvalues, yvalues)
+
+			if grid is None:
+				stream.write('\\addplot3[{0}] table[x index=0, y index=1, z index=2, header=false] {{{1}}};\n'.format(
+					','.join(options), filename))
+			else:
+				# only z-coordinates are stored, x and y are computed from the index
+				options.insert(2, 'mesh/cols={0}'.format(zvalues.shape[1]))
+
+				stream.write('\\addplot3[{0}] table[{1}, {2}, z index=0, header=false] {{{3}}};\n'.format(
+					','.join(options),
+					'x expr={{{0!r}+({1!r})*mod(\\coordindex,{2})}}'.format(grid[0], grid[1], zvalues.shape[1]),
+					'y expr={{{0!r}+({1!r})*floor(\\coordindex/{2})}}'.format(grid[2], grid[3], zvalues.shape[1]),
+					filename))
+		else:
+			stream.write('\\addplot3[{0}] coordinates {{\n'.format(','.join(options)))
+			write_coordinates(stream, [xvalues, yvalues, zvalues])
+			stream.write('};\n')
+
+
+	def filename(self):
+		return \
+			str(self.axes.figure._session) + '_surf_' + \
+			str(self.idx) + '.dat'
+
+
+	def save(self, filepath=''):
+		"""
+		Writes vertices into a whitespace-separated data file. If the vertices
+		form an evenly spaced grid, only z-coordinates are written.
+
+		@type  filepath: string
+		@param filepath: directory in which the data file is stored
+		"""
+
+		xvalues, yvalues, zvalues = self._mesh()
+
+		with open(path.join(filepath, self.filename()), 'w') as handle:
+			if self._grid(xvalues, yvalues) is None:
+				write_table(handle, [xvalues, yvalues, zvalues])
+			else:
+				write_table(handle, [zvalues])
+
+
+	def _mesh(self):
+		"""
+		Returns the vertices of the mesh. If the mesh has more rows or columns
+		than allowed by C{max_mesh}, only evenly spaced rows and columns are kept,
+		including the first and last. Where possible, every n-th row or column
+		is kept, so that evenly spaced grids stay evenly spaced.
+
+		@rtype: list
+		@return: x-, y- and z-coordinates of vertices arranged in a grid
+		"""
+
+		values = [asarray(self.xvalues), asarray(self.yvalues), asarray(self.zvalues)]
+
+		if self.max_mesh is None:
+			return values
+
+		indices = []
+		for size, max_size in zip(values[2].shape, self.max_mesh):
+			if size > max_size > 1:
+				# smallest constant step which keeps at most max_size rows or columns
+				step = (size - 2) // (max_size - 1) + 1
+
+				# the step has to reach the last row or column, but should not
+				# reduce the resolution by more than half
+				for step in range(step, 2 * step):
+					if (size - 1) % step == 0:
+						indices.append(arange(0, size, step))
+						break
+				else:
+					indices.append(asarray(around(linspace(0, size - 1, max_size)), dtype=int))
+			else:
+				indices.append(arange(size))
+
+		return [v[ix_(*indices)] for v in values]
+
+
+	def _grid(self, xvalues, yvalues):
+		"""
+		Tests whether vertices form an evenly spaced grid, where x-coordinates
+		only change from column to column and y-coordinates from row to row.
+
+		@rtype: tuple/None
+		@return: first x-coordinate, x-spacing, first y-coordinate and y-spacing, or None
+		"""
+
+		xaxis, yaxis = xvalues[0], yvalues[:, 0]
+
+		if xaxis.dtype.kind not in ['i', 'u', 'f'] or yaxis.dtype.kind not in ['i', 'u', 'f']:
+			return None
+
+		if not all(xvalues == xaxis) or not all(yvalues == yaxis[:, None]):
+			return None
 
-		tex = '\\addplot3[{0}] coordinates {{\n'.format(options_string)
-		for i in range(self.zvalues.shape[0]):
-			for j in range(self.zvalues.shape[1]):
-				tex += '\t({0}, {1}, {2})\n'.format(
-					self.xvalues[i, j], self.yvalues[i, j], self.zvalues[i, j])
-		tex += '};\n'
+		grid = []
+		for axis in [xaxis, yaxis]:
+			step = (axis[-1] - axis[0]) / (len(axis) - 1.) if len(axis) > 1 else 0.
+			if len(axis) > 2 and not allclose(diff(axis), step):
+				return None
+			grid.extend([float(axis[0]), float(step)])
 
-		return tex
+		return tuple(grid)
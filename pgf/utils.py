@@ -1,4 +1,4 @@
-from numpy import min, max, iterable
+from numpy import min, max, iterable, asarray
 from string import rstrip
 
 def indent(text, times=1, ind='\t'):
@@ -20,6 +20,79 @@ def indent(text, times=1, ind='\t'):
 	return '\n'.join([rstrip(ind + line) for line in text.split('\n')])
 
 
+class IndentedWriter(object):
+	"""
+	Wraps a file-like object and indents everything written to it. Used to
+	stream LaTeX code into a file without first assembling and re-indenting
+	the code in memory.
+
+	@type stream: file
+	@ivar stream: file-like object the indented text is written to
+
+	@type level: integer
+	@ivar level: number of indentations
+	"""
+
+	def __init__(self, stream, level=1, ind='\t'):
+		"""
+		@type  stream: file
+		@param stream: a file-like object or another L{IndentedWriter}
+
+		@type  level: integer
+		@param level: number of indentations
+
+		@type  ind: string
+		@param ind: string inserted at the beginning of each line
+		"""
+
+		if isinstance(stream, IndentedWriter):
+			# avoid indenting the same text multiple times
+			level += stream.level
+			stream = stream.stream
+
+		self.stream = stream
+		self.level = level
+		self.ind = ind
+
+		# whether the next write starts a new line
+		self._newline = True
+
+
+	def write(self, text):
+		if not text:
+			return
+
+		prefix = self.ind * self.level
+
+		if prefix:
+			lines = text.split('\n')
+			if self._newline:
+				lines[0] = rstrip(prefix + lines[0])
+			lines[1:] = [rstrip(prefix + line) for line in lines[1:]]
+			text = '\n'.join(lines)
+
+		self.stream.write(text)
+		self._newline = text.endswith('\n')
+
+
+def render_to(obj, stream):
+	"""
+	Writes the LaTeX code of a figure element to a stream, using the element's
+	own streaming implementation if available.
+
+	@type  obj: object
+	@param obj: an object with a C{render} or C{render_to} method
+
+	@type  stream: file
+	@param stream: file-like object
+	"""
+
+	if hasattr(obj, 'render_to'):
+		obj.render_to(stream)
+	else:
+		stream.write(obj.render())
+
+
 def min_free(indices):
 	if not indices:
 		return 0
@@ -51,3 +124,130 @@ def escape(string):
 		return '{' + str(string) + '}'
 
 	return string
+
+
+
+def format_coordinates(columns, errors=None, labels=None, ind='\t'):
+	"""
+	Formats data points as PGFPlots coordinates, one point per line. All data
+	points are formatted by a single string formatting operation, so that the
+	cost of rendering large data sets is not dominated by the interpreter.
+
+	@type  columns: list
+	@param columns: coordinates, e.g. [xvalues, yvalues] or [xvalues, yvalues, zvalues]
+
+	@type  errors: list/None
+	@param errors: error bar sizes in the form [xvalues_error, yvalues_error]
+
+	@type  labels: list/None
+	@param labels: a string labeling each data point
+
+	@type  ind: string
+	@param ind: string inserted at the beginning of each line
+
+	@rtype: string
+	@return: coordinates separated by newlines
+	"""
+
+	columns = [asarray(c).ravel() for c in columns]
+	line = ind + '(' + ', '.join(_format(c) for c in columns) + ')'
+
+	if errors is not None:
+		errors = [asarray(e).ravel() for e in errors]
+		line += ' +- (' + ', '.join(_format(e) for e in errors) + ')'
+		columns = columns + errors
+
+	if labels is not None:
+		line += ' [%s]'
+		columns = columns + [labels]
+
+	return _interleave(line + '\n', columns)
+
+
+def format_table(columns):
+	"""
+	Formats data points as rows of whitespace-separated columns, as read by
+	PGFPlots' C{\\addplot table}.
+
+	@type  columns: list
+	@param columns: list of columns, e.g. [xvalues, yvalues]
+
+	@rtype: string
+	@return: one row per data point separated by newlines
+	"""
+
+	columns = [asarray(c).ravel() for c in columns]
+
+	return _interleave(' '.join(_format(c) for c in columns) + '\n', columns)
+
+
+def write_coordinates(stream, columns, errors=None, labels=None, ind='\t', chunk_size=65536):
+	"""
+	Writes data points as PGFPlots coordinates to a stream. Data points are
+	formatted in chunks, so that memory requirements do not grow with the
+	number of data points. See L{format_coordinates}.
+
+	@type  stream: file
+	@param stream: file-like object
+
+	@type  chunk_size: integer
+	@param chunk_size: number of data points formatted at once
+	"""
+
+	columns = [asarray(c).ravel() for c in columns]
+	if errors is not None:
+		errors = [asarray(e).ravel() for e in errors]
+
+	for i in range(0, len(columns[0]), chunk_size):
+		stream.write(format_coordinates(
+			[c[i:i + chunk_size] for c in columns],
+			None if errors is None else [e[i:i + chunk_size] for e in errors],
+			None if labels is None else labels[i:i + chunk_size],
+			ind))
+
+
+def write_table(stream, columns, chunk_size=65536):
+	"""
+	Writes data points as whitespace-separated columns to a stream. See
+	L{format_table}.
+
+	@type  stream: file
+	@param stream: file-like object
+
+	@type  chunk_size: integer
+	@param chunk_size: number of data points formatted at once
+	"""
+
+	columns = [asarray(c).ravel() for c in columns]
+
+	for i in range(0, len(columns[0]), chunk_size):
+		stream.write(format_table([c[i:i + chunk_size] for c in columns]))
+
+
+def _format(values):
+	"""
+	Returns a format specifier for an array. Integers are printed exactly and
+	floating point numbers with the same precision as C{str}.
+	"""
+
+	if values.dtype.kind in ['b', 'i', 'u']:
+		return '%d'
+	if values.dtype.kind == 'f':
+		return '%.12g'
+	return '%s'
+
+
+def _interleave(line, columns):
+	"""
+	Formats one line per data point, taking one value from each column.
+	"""
+
+	num_columns = len(columns)
+	num_rows = len(columns[0])
+
+	# values ordered row by row
+	values = [None] * (num_rows * num_columns)
+	for i, column in enumerate(columns):
+		values[i::num_columns] = column.tolist() if hasattr(column, 'tolist') else list(column)
+
+	return (line * num_rows) % tuple(values)